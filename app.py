@@ -1,17 +1,42 @@
 """EthicsNavi - 臨床倫理4分割AI相談 メインアプリ"""
 
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 
-from config import QUADRANTS, DISCLAIMER, PRIVACY_NOTICE
+from config import (
+    QUADRANTS,
+    DISCLAIMER,
+    PRIVACY_NOTICE,
+    CASE_ARCHIVE_NOTICE,
+    SESSION_STORE_BACKEND,
+    SESSION_STORE_NOTICE,
+    SPECULATIVE_TURNS,
+    PREFETCH_OPENING_QUESTIONS,
+    CASE_ARCHIVE_ENABLED,
+    METRICS_HOST,
+    METRICS_PORT,
+)
 from claude_client import EthicsNaviClient
 from session_manager import (
     init_session,
     get_current_quadrant,
     add_message,
     advance_quadrant,
+    go_to,
     reset_session,
+    store_opening_questions,
+    take_opening_question,
+    mark_computed,
+    is_stale,
+    archive_record,
+    restore_session,
+    persist_session,
 )
-from pdf_generator import generate_pdf
+from case_archive import get_case_archive
+from pdf_generator import PDFCache
+from telemetry import set_correlation_id, start_metrics_server
 
 st.set_page_config(
     page_title="EthicsNavi - 臨床倫理4分割表",
@@ -20,6 +45,9 @@ st.set_page_config(
 )
 
 init_session()
+# 前回の実行で画面側が直接変えた状態（フェーズ・要約・表など）も保存先に反映する
+persist_session()
+set_correlation_id(st.session_state.correlation_id)
 
 
 # --- サイドバー ---
@@ -85,154 +113,227 @@ def get_client():
     return EthicsNaviClient()
 
 
-client = get_client()
+@st.cache_resource
+def get_executor():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="ethicsnavi")
 
 
-# --- Phase 1: ケース入力 ---
-if st.session_state.phase == "input":
-    st.header("ケース概要を入力してください")
-    st.error(PRIVACY_NOTICE)
-    st.markdown("倫理的に検討が必要なケースの概要を自由に記述してください。")
+@st.cache_resource
+def get_pdf_cache():
+    return PDFCache()
 
-    case_text = st.text_area(
-        "ケース概要",
-        height=200,
-        placeholder="例: 80歳男性、進行性肺癌。本人は積極的治療を望んでいないが、家族は治療継続を強く希望している...",
-    )
 
-    if st.button("整理を開始する", type="primary", disabled=not case_text.strip()):
-        st.session_state.case_overview = case_text.strip()
-        st.session_state.phase = "quadrant"
-        st.rerun()
+@st.cache_resource
+def get_metrics_server():
+    return start_metrics_server(METRICS_PORT, METRICS_HOST) if METRICS_PORT else None
 
 
-# --- Phase 2: 4象限対話 ---
-elif st.session_state.phase == "quadrant":
-    quad = get_current_quadrant()
-    quad_idx = st.session_state.current_quadrant + 1
+@st.cache_resource
+def get_archive():
+    return get_case_archive() if CASE_ARCHIVE_ENABLED else None
 
-    st.header(f"{quad_idx}. {quad['title_ja']}（{quad['title_en']}）")
-    st.caption(f"サブトピック: {' / '.join(quad['subtopics'])}")
 
+client = get_client()
+executor = get_executor()
+pdf_cache = get_pdf_cache()
+archive = get_archive()
+get_metrics_server()
+
+
+def prebuild_pdf(table_data: dict):
+    """PDFを先行生成し、表データが変わっていれば古いPDFをキャッシュから外す"""
+    key = pdf_cache.prebuild(executor, st.session_state.case_overview, table_data)
+    previous_key = st.session_state.get("pdf_cache_key")
+    if previous_key and previous_key != key:
+        pdf_cache.invalidate(previous_key)
+    st.session_state.pdf_cache_key = key
+
+
+def table_grid() -> dict:
+    """4分割表の2x2の枠を描画し、象限キー → 枠のコンテナを返す"""
+    cells = {}
+    for row in (QUADRANTS[:2], QUADRANTS[2:]):
+        for col, quad in zip(st.columns(2), row):
+            cell = col.container(border=True)
+            cell.subheader(f"{QUADRANTS.index(quad) + 1}. {quad['title_ja']}")
+            cells[quad["key"]] = cell
+    return cells
+
+
+def prefetch_opening_questions():
+    """2象限目以降の最初の質問を裏で並行して生成し始める（ケース概要だけで決まるため）
+
+    画面を移っても使うため、セッション全体の取消トークン（リセットで取り消す）で実行する。
+    イベントループで直接実行し、スレッドプール（完了チェック・PDF生成と共有）は使わない。
+    """
+    store_opening_questions({
+        quad["key"]: client.prefetch_opening_question(
+            st.session_state.case_overview,
+            quad["key"],
+            st.session_state.cancel_token,
+        )
+        for quad in QUADRANTS[1:]
+    })
+
+
+def stream_until_complete(stream, completion_future):
+    """完了チェックが完了判定を返した時点でストリームを打ち切る"""
+    try:
+        for chunk in stream:
+            if completion_future.done() and completion_future.result()["is_complete"]:
+                return
+            yield chunk
+    finally:
+        stream.close()
+
+
+@st.fragment
+def quadrant_turns(quad: dict, history):
+    """象限の対話の1ターン分（最初の質問の生成、回答の受け付け、完了チェック、次の質問）
+
+    ターンごとにこの部分だけを再実行する。新しいメッセージは画面全体の実行で作った
+    会話履歴のコンテナ history に追記する。フラグメントの外のコンテナに書いた要素は
+    フラグメントの再実行では消えないため、それまでのメッセージは描き直さない。
+    象限が完了したときだけ画面全体を再実行する。
+    """
     conversation = st.session_state.conversations[quad["key"]]
 
-    # 会話履歴を表示
-    for msg in conversation:
-        with st.chat_message(msg["role"]):
-            st.markdown(msg["content"])
-
-    # 初回: AIの最初の質問を生成
+    # 初回: AIの最初の質問を生成（先行生成中ならその結果を待ち、失敗していればその場で生成）
     if len(conversation) == 0:
-        with st.chat_message("assistant"):
-            response = st.write_stream(
-                client.ask_quadrant_questions_stream(
-                    case_overview=st.session_state.case_overview,
-                    quadrant_key=quad["key"],
-                    conversation=[],
+        with st.spinner("質問を準備中..."):
+            prefetched = take_opening_question(quad["key"], timeout=None)
+        with history, st.chat_message("assistant"):
+            if prefetched:
+                response = prefetched
+                st.markdown(response)
+            else:
+                response = st.write_stream(
+                    client.ask_quadrant_questions_stream(
+                        case_overview=st.session_state.case_overview,
+                        quadrant_key=quad["key"],
+                        conversation=[],
+                        cancel_token=st.session_state.view_token,
+                    )
                 )
-            )
         add_message(quad["key"], "assistant", response)
-        st.rerun()
 
     # ユーザー入力
     if user_input := st.chat_input("回答を入力してください..."):
         add_message(quad["key"], "user", user_input)
-
-        # 完了チェック
-        completion = client.check_quadrant_completion(
-            quadrant_key=quad["key"],
-            conversation=st.session_state.conversations[quad["key"]],
-        )
+        conversation = st.session_state.conversations[quad["key"]]
+        with history, st.chat_message("user"):
+            st.markdown(user_input)
+
+        response = None
+        if SPECULATIVE_TURNS:
+            # 完了チェックの結果を待たず、前回の未整理サブトピックで次の質問を生成し始める
+            completion_future = client.submit_completion_check(
+                quadrant_key=quad["key"],
+                conversation=list(conversation),
+                case_overview=st.session_state.case_overview,
+                coverage=st.session_state.coverage[quad["key"]],
+                cancel_token=st.session_state.view_token,
+            )
+            with history, st.chat_message("assistant"):
+                response = st.write_stream(
+                    stream_until_complete(
+                        client.ask_quadrant_questions_stream(
+                            case_overview=st.session_state.case_overview,
+                            quadrant_key=quad["key"],
+                            conversation=conversation,
+                            remaining_subtopics=st.session_state.coverage[quad["key"]]["remaining_subtopics"],
+                            coverage=st.session_state.coverage[quad["key"]],
+                            cancel_token=st.session_state.view_token,
+                        ),
+                        completion_future,
+                    )
+                )
+            completion = completion_future.result()
+        else:
+            # 完了チェック
+            completion = client.check_quadrant_completion(
+                quadrant_key=quad["key"],
+                conversation=conversation,
+                case_overview=st.session_state.case_overview,
+                coverage=st.session_state.coverage[quad["key"]],
+                cancel_token=st.session_state.view_token,
+            )
+        st.session_state.coverage[quad["key"]] = completion
 
         if completion["is_complete"]:
             st.session_state.quadrant_summaries[quad["key"]] = completion["summary"]
+            mark_computed(f"summary:{quad['key']}")
             st.toast(f"{quad['title_ja']}の整理が完了しました", icon="\u2705")
             advance_quadrant()
             st.rerun()
         else:
             remaining = completion.get("remaining_subtopics", quad["subtopics"])
-            with st.chat_message("assistant"):
-                response = st.write_stream(
-                    client.ask_quadrant_questions_stream(
-                        case_overview=st.session_state.case_overview,
-                        quadrant_key=quad["key"],
-                        conversation=st.session_state.conversations[quad["key"]],
-                        remaining_subtopics=remaining,
+            if response is None:
+                with history, st.chat_message("assistant"):
+                    response = st.write_stream(
+                        client.ask_quadrant_questions_stream(
+                            case_overview=st.session_state.case_overview,
+                            quadrant_key=quad["key"],
+                            conversation=conversation,
+                            remaining_subtopics=remaining,
+                            coverage=completion,
+                            cancel_token=st.session_state.view_token,
+                        )
                     )
-                )
             add_message(quad["key"], "assistant", response)
-            st.rerun()
 
-    # 手動ナビゲーション
-    col1, col2 = st.columns(2)
-    with col1:
-        if st.session_state.current_quadrant > 0:
-            if st.button("\u2190 前の象限に戻る"):
-                st.session_state.current_quadrant -= 1
-                st.rerun()
-    with col2:
-        if st.button("この象限を完了して次へ \u2192", type="primary"):
-            # 強制的に要約して次へ
-            conv = st.session_state.conversations[quad["key"]]
-            if conv:
-                completion = client.check_quadrant_completion(
-                    quadrant_key=quad["key"],
-                    conversation=conv,
-                )
-                st.session_state.quadrant_summaries[quad["key"]] = (
-                    completion.get("summary", "")
-                )
-            advance_quadrant()
-            st.rerun()
 
+@st.fragment
+def summary_table():
+    """4分割表・検討ポイント・緊張関係（表が古ければその場で統合し直す）"""
+    if st.session_state.full_table_data is None or is_stale("table_data"):
+        # 要約が変わっていない象限の表は使い回し、確定した項目から順に表を埋めていく
+        previous = (st.session_state.full_table_data or {}).get("table", {})
+        reuse = {k: v for k, v in previous.items() if v and not is_stale(f"table:{k}")}
+        live = st.empty()
+        with live.container():
+            cells = table_grid()
+            points_area = st.container()
+            tensions_area = st.container()
+            with st.spinner("4分割表を生成中..."):
+                for event in client.synthesize_table_stream(
+                    case_overview=st.session_state.case_overview,
+                    quadrant_summaries={
+                        k: v or "（未整理）"
+                        for k, v in st.session_state.quadrant_summaries.items()
+                    },
+                    reuse=reuse,
+                    cancel_token=st.session_state.view_token,
+                ):
+                    if event["type"] == "entry" and event["quadrant"] in cells:
+                        cells[event["quadrant"]].markdown(f"**{event['subtopic']}**")
+                        cells[event["quadrant"]].markdown(f"{event['text']}")
+                    elif event["type"] == "discussion_point":
+                        points_area.markdown(f"- {event['text']}")
+                    elif event["type"] == "tension":
+                        tensions_area.markdown(f"- {event['text']}")
+                    elif event["type"] == "done":
+                        st.session_state.full_table_data = event["table_data"]
+                        mark_computed("table_data")
+                        for quad in QUADRANTS:
+                            mark_computed(f"table:{quad['key']}")
+                        persist_session()
+                        if archive is not None:
+                            archive.save(st.session_state.archive_id, archive_record())
+        # 生成中の表を、確定した表の表示に置き換える（画面全体は再実行しない）
+        live.empty()
 
-# --- Phase 3: まとめ ---
-elif st.session_state.phase == "summary":
-    st.header("Jonsenの臨床倫理4分割表")
+    table_data = st.session_state.full_table_data
 
-    if st.session_state.full_table_data is None:
-        with st.spinner("4分割表を生成中..."):
-            table_data = client.synthesize_table(
-                case_overview=st.session_state.case_overview,
-                quadrant_summaries={
-                    k: v or "（未整理）"
-                    for k, v in st.session_state.quadrant_summaries.items()
-                },
-            )
-            st.session_state.full_table_data = table_data
-    else:
-        table_data = st.session_state.full_table_data
+    # レポート画面をすぐ開けるよう、PDFを裏で生成しておく
+    prebuild_pdf(table_data)
 
     # 4分割表を2x2で表示
     table = table_data.get("table", {})
-
-    col1, col2 = st.columns(2)
-    with col1:
-        with st.container(border=True):
-            st.subheader("1. 医学的適応")
-            for k, v in table.get("medical_indications", {}).items():
-                st.markdown(f"**{k}**")
-                st.markdown(f"{v}")
-    with col2:
-        with st.container(border=True):
-            st.subheader("2. 患者の意向")
-            for k, v in table.get("patient_preferences", {}).items():
-                st.markdown(f"**{k}**")
-                st.markdown(f"{v}")
-
-    col3, col4 = st.columns(2)
-    with col3:
-        with st.container(border=True):
-            st.subheader("3. QOL")
-            for k, v in table.get("qol", {}).items():
-                st.markdown(f"**{k}**")
-                st.markdown(f"{v}")
-    with col4:
-        with st.container(border=True):
-            st.subheader("4. 周囲の状況")
-            for k, v in table.get("contextual_features", {}).items():
-                st.markdown(f"**{k}**")
-                st.markdown(f"{v}")
+    for key, cell in table_grid().items():
+        for k, v in table.get(key, {}).items():
+            cell.markdown(f"**{k}**")
+            cell.markdown(f"{v}")
 
     # 検討ポイント
     st.divider()
@@ -247,20 +348,14 @@ elif st.session_state.phase == "summary":
         for tension in tensions:
             st.markdown(f"- {tension}")
 
-    st.divider()
-    if st.button("PDFレポートを生成する", type="primary"):
-        st.session_state.phase = "report"
-        st.rerun()
-
-
-# --- Phase 4: レポート出力 ---
-elif st.session_state.phase == "report":
-    st.header("レポート出力")
 
+@st.fragment
+def report_view():
+    """PDFのダウンロードと4分割表（ダウンロードしても画面全体は再実行しない）"""
     table_data = st.session_state.full_table_data
 
     with st.spinner("PDF を生成中..."):
-        pdf_bytes = generate_pdf(
+        pdf_bytes = pdf_cache.get(
             case_overview=st.session_state.case_overview,
             table_data=table_data,
         )
@@ -303,3 +398,137 @@ elif st.session_state.phase == "report":
             st.markdown("**4. 周囲の状況**")
             for k, v in table.get("contextual_features", {}).items():
                 st.markdown(f"- **{k}**: {v}")
+
+
+# --- Phase 1: ケース入力 ---
+if st.session_state.phase == "input":
+    st.header("ケース概要を入力してください")
+    st.error(PRIVACY_NOTICE)
+    if SESSION_STORE_BACKEND is not None:
+        st.warning(SESSION_STORE_NOTICE)
+    if archive is not None:
+        st.warning(CASE_ARCHIVE_NOTICE)
+    st.markdown("倫理的に検討が必要なケースの概要を自由に記述してください。")
+
+    case_text = st.text_area(
+        "ケース概要",
+        height=200,
+        placeholder="例: 80歳男性、進行性肺癌。本人は積極的治療を望んでいないが、家族は治療継続を強く希望している...",
+    )
+
+    if st.button("整理を開始する", type="primary", disabled=not case_text.strip()):
+        st.session_state.case_overview = case_text.strip()
+        go_to("quadrant")
+        if PREFETCH_OPENING_QUESTIONS:
+            prefetch_opening_questions()
+        st.rerun()
+
+    # 過去のケースを開き直す（保存時の要約と表を使うため API は呼ばない）
+    if archive is not None:
+        st.divider()
+        with st.expander("過去のケースを検索して開く"):
+            query = st.text_input(
+                "検索語（ケース概要・要約・4分割表の内容）",
+                key="archive_query",
+                on_change=lambda: st.session_state.update(archive_page=0),
+            )
+            page = st.session_state.get("archive_page", 0)
+            results = archive.search(query, page=page)
+            if not results["items"]:
+                st.caption("該当するケースはありません")
+            for item in results["items"]:
+                saved = time.strftime("%Y-%m-%d %H:%M", time.localtime(item["saved"]))
+                with st.container(border=True):
+                    st.caption(saved)
+                    st.markdown(item["preview"])
+                    col1, col2 = st.columns(2)
+                    for col, phase, label in (
+                        (col1, "summary", "4分割表を開く"),
+                        (col2, "report", "レポートを開く"),
+                    ):
+                        if col.button(label, key=f"open_{phase}_{item['case_id']}"):
+                            record = archive.load(item["case_id"])
+                            if record is not None:
+                                restore_session(item["case_id"], record, phase)
+                                st.rerun()
+            col1, col2 = st.columns(2)
+            if col1.button("\u2190 前へ", disabled=page == 0):
+                st.session_state.archive_page = page - 1
+                st.rerun()
+            if col2.button("次へ \u2192", disabled=not results["has_more"]):
+                st.session_state.archive_page = page + 1
+                st.rerun()
+
+
+# --- Phase 2: 4象限対話 ---
+elif st.session_state.phase == "quadrant":
+    quad = get_current_quadrant()
+    quad_idx = st.session_state.current_quadrant + 1
+
+    st.header(f"{quad_idx}. {quad['title_ja']}（{quad['title_en']}）")
+    st.caption(f"サブトピック: {' / '.join(quad['subtopics'])}")
+
+    conversation = st.session_state.conversations[quad["key"]]
+
+    # 会話履歴を表示（以降のターンは quadrant_turns がこのコンテナに追記する）
+    history = st.container()
+    with history:
+        for msg in conversation:
+            with st.chat_message(msg["role"]):
+                st.markdown(msg["content"])
+
+    quadrant_turns(quad, history)
+
+    # 手動ナビゲーション
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.session_state.current_quadrant > 0:
+            if st.button("\u2190 前の象限に戻る"):
+                go_to("quadrant", st.session_state.current_quadrant - 1)
+                st.rerun()
+    with col2:
+        if st.button("この象限を完了して次へ \u2192", type="primary"):
+            # 強制的に要約して次へ（要約後に会話が変わっていなければ要約し直さない）
+            conv = st.session_state.conversations[quad["key"]]
+            if conv and is_stale(f"summary:{quad['key']}"):
+                completion = client.check_quadrant_completion(
+                    quadrant_key=quad["key"],
+                    conversation=conv,
+                    case_overview=st.session_state.case_overview,
+                    coverage=st.session_state.coverage[quad["key"]],
+                    allow_precheck=False,
+                    cancel_token=st.session_state.view_token,
+                )
+                st.session_state.coverage[quad["key"]] = completion
+                st.session_state.quadrant_summaries[quad["key"]] = (
+                    completion.get("summary", "")
+                )
+                mark_computed(f"summary:{quad['key']}")
+            advance_quadrant()
+            st.rerun()
+
+
+# --- Phase 3: まとめ ---
+elif st.session_state.phase == "summary":
+    st.header("Jonsenの臨床倫理4分割表")
+
+    summary_table()
+
+    st.divider()
+    col1, col2 = st.columns(2)
+    with col1:
+        # 戻って修正した象限だけが要約・統合し直される
+        if st.button("\u2190 前の象限に戻る"):
+            go_to("quadrant", len(QUADRANTS) - 1)
+            st.rerun()
+    with col2:
+        if st.button("PDFレポートを生成する", type="primary"):
+            go_to("report")
+            st.rerun()
+
+
+# --- Phase 4: レポート出力 ---
+elif st.session_state.phase == "report":
+    st.header("レポート出力")
+
+    report_view()
@@ -0,0 +1,211 @@
+"""匿名化済みケースのJSONLを一括処理し、4分割表とPDFを出力するバッチモード
+
+使い方:
+    python batch.py cases.jsonl --out batch_output
+
+入力は1行1ケースのJSON:
+    {"id": "case-001", "case_overview": "...",
+     "quadrants": {"medical_indications": ["回答1", "回答2"], "qol": "回答", ...}}
+
+各ケースの完了チェックと統合は上限付きで並行に実行し、PDFはプロセスプールで生成する。
+結果は処理が終わったケースから results.jsonl と <id>.pdf に書き出し、
+完了したケースIDを checkpoint.txt に記録する。再実行時は記録済みのケースを飛ばす。
+ケースIDは一意であること（ファイル名に使えない文字を含むIDは、PDF名にハッシュを付ける）。
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from claude_client import AsyncEthicsNaviClient
+from config import (
+    QUADRANTS,
+    BATCH_CONCURRENCY,
+    BATCH_REQUESTS_PER_MINUTE,
+    BATCH_PDF_WORKERS,
+)
+from pdf_generator import generate_pdf
+from scheduler import RequestScheduler
+from telemetry import metrics_snapshot, set_correlation_id
+
+logger = logging.getLogger(__name__)
+
+
+def load_cases(path: str) -> list[dict]:
+    """入力JSONLを読み込む（空行は無視）
+
+    ケースIDは結果とチェックポイントのキーになるため、重複していれば ValueError を送出する。
+    """
+    cases = []
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            case = json.loads(line)
+            case.setdefault("id", f"case-{line_no:04d}")
+            if case["id"] in seen:
+                raise ValueError(f"{path}:{line_no}: duplicate case id {case['id']!r}")
+            seen.add(case["id"])
+            cases.append(case)
+    return cases
+
+
+def load_checkpoint(path: str) -> set[str]:
+    """完了済みのケースID"""
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def answers_to_conversation(answers) -> list[dict]:
+    """事前入力された回答を完了チェック用の会話に変換"""
+    if isinstance(answers, str):
+        answers = [answers]
+    return [{"role": "user", "content": a} for a in answers or [] if a.strip()]
+
+
+def _pdf_filename(case_id: str) -> str:
+    """ケースIDからPDFのファイル名を作る
+
+    ファイル名に使えない文字を置き換えた場合は、IDの短いハッシュを付けて
+    別のID（"c/2" と "c_2" など）と重ならないようにする。
+    """
+    name = re.sub(r"[^\w.-]", "_", case_id)
+    if name != case_id:
+        name += "-" + hashlib.sha256(case_id.encode()).hexdigest()[:8]
+    return name + ".pdf"
+
+
+async def process_case(
+    client: AsyncEthicsNaviClient,
+    pdf_pool: ProcessPoolExecutor,
+    case: dict,
+    out_dir: str,
+) -> dict:
+    """1ケースを処理してPDFを書き出し、結果のレコードを返す"""
+    started = time.perf_counter()
+
+    async def summarize(quad: dict) -> tuple[str, str]:
+        conversation = answers_to_conversation(case.get("quadrants", {}).get(quad["key"]))
+        if not conversation:
+            return quad["key"], "（未整理）"
+        completion = await client.check_quadrant_completion(
+            quadrant_key=quad["key"],
+            conversation=conversation,
+            case_overview=case["case_overview"],
+            allow_precheck=False,
+        )
+        return quad["key"], completion.get("summary") or "（未整理）"
+
+    quadrant_summaries = dict(await asyncio.gather(*(summarize(q) for q in QUADRANTS)))
+
+    table_data = await client.synthesize_table(
+        case_overview=case["case_overview"],
+        quadrant_summaries=quadrant_summaries,
+    )
+
+    pdf_bytes = await asyncio.get_running_loop().run_in_executor(
+        pdf_pool, generate_pdf, case["case_overview"], table_data
+    )
+    pdf_path = os.path.join(out_dir, _pdf_filename(case["id"]))
+    with open(pdf_path, "wb") as f:
+        f.write(pdf_bytes)
+
+    return {
+        "id": case["id"],
+        "status": "ok",
+        "quadrant_summaries": quadrant_summaries,
+        "table_data": table_data,
+        "pdf": pdf_path,
+        "elapsed_s": round(time.perf_counter() - started, 2),
+    }
+
+
+async def run_batch(
+    cases: list[dict],
+    out_dir: str,
+    concurrency: int = BATCH_CONCURRENCY,
+    requests_per_minute: int = BATCH_REQUESTS_PER_MINUTE,
+    pdf_workers: int = BATCH_PDF_WORKERS,
+) -> dict:
+    """未完了のケースを並行処理し、終わったものから結果とチェックポイントを書き出す"""
+    os.makedirs(out_dir, exist_ok=True)
+    results_path = os.path.join(out_dir, "results.jsonl")
+    checkpoint_path = os.path.join(out_dir, "checkpoint.txt")
+
+    done = load_checkpoint(checkpoint_path)
+    pending = [c for c in cases if c["id"] not in done]
+    logger.info("batch total=%d done=%d pending=%d", len(cases), len(done), len(pending))
+
+    # API呼び出しの流量制限と再試行はクライアントのスケジューラが行う
+    client = AsyncEthicsNaviClient(scheduler=RequestScheduler(requests_per_minute=requests_per_minute))
+    semaphore = asyncio.Semaphore(concurrency)
+    counts = {"ok": 0, "error": 0, "skipped": len(cases) - len(pending)}
+
+    with ProcessPoolExecutor(max_workers=pdf_workers) as pdf_pool, \
+            open(results_path, "a", encoding="utf-8") as results, \
+            open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+
+        async def run_one(case: dict):
+            set_correlation_id(case["id"])
+            async with semaphore:
+                try:
+                    record = await process_case(client, pdf_pool, case, out_dir)
+                except Exception as e:
+                    logger.exception("batch case=%s failed", case["id"])
+                    record = {"id": case["id"], "status": "error", "error": repr(e)}
+            results.write(json.dumps(record, ensure_ascii=False) + "\n")
+            results.flush()
+            if record["status"] == "ok":
+                # 失敗したケースは記録せず、再実行時にやり直す
+                checkpoint.write(case["id"] + "\n")
+                checkpoint.flush()
+            counts[record["status"]] += 1
+            logger.info(
+                "batch case=%s status=%s progress=%d/%d",
+                case["id"], record["status"], counts["ok"] + counts["error"], len(pending),
+            )
+
+        await asyncio.gather(*(run_one(c) for c in pending))
+
+    return {
+        **counts,
+        "usage": dict(client.usage_totals),
+        "response_cache": client.response_cache_stats(),
+        "metrics": metrics_snapshot(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("cases", help="入力JSONL")
+    parser.add_argument("--out", default="batch_output", help="出力ディレクトリ")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--rpm", type=int, default=BATCH_REQUESTS_PER_MINUTE, help="1分あたりのAPI呼び出し上限")
+    parser.add_argument("--pdf-workers", type=int, default=BATCH_PDF_WORKERS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    summary = asyncio.run(run_batch(
+        load_cases(args.cases),
+        args.out,
+        concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        pdf_workers=args.pdf_workers,
+    ))
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    sys.exit(1 if summary["error"] else 0)
+
+
+if __name__ == "__main__":
+    main()
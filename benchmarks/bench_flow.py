@@ -0,0 +1,231 @@
+"""4象限の対話フロー全体のベンチマーク（ローカルの代替サーバーを使用し、API は呼ばない）
+
+使い方:
+    python benchmarks/bench_flow.py --cases 5 --sessions 2 --tokens-per-sec 60 --ttft-ms 400
+
+app.py と同じ順序で、各象限の最初の質問、回答ごとの完了チェックと次の質問
+（SPECULATIVE_TURNS に従う）、統合、PDF生成を実行する。最初のトークンまでの時間、
+ターンごとの待ち時間、ケースあたりの入出力トークン数、統合とPDF生成の時間・メモリを計測する。
+--json で機械可読な結果を出力する。
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_pdf import SAMPLE_CASE_OVERVIEW, _max_rss_mb  # noqa: E402
+from claude_client import EthicsNaviClient  # noqa: E402
+from config import QUADRANTS, SPECULATIVE_TURNS  # noqa: E402
+from coverage import new_coverage_state  # noqa: E402
+from fake_anthropic import start_server  # noqa: E402
+
+# 各象限で順に使う回答（キーワードを含めてローカル判定が完了チェックを省略しすぎないようにする）
+SAMPLE_ANSWERS = {
+    "medical_indications": [
+        "診断はステージIVの肺癌で、予後は数ヶ月と説明されています。治療の目標はチーム内でも議論があります。",
+        "治療の選択肢は化学療法と緩和ケアです。化学療法は効果が乏しいとの意見もあり、無益ではないかという声もあります。",
+    ],
+    "patient_preferences": [
+        "本人は自宅で過ごしたいと希望しています。病状の説明と同意は本人・家族同席で行いました。",
+        "認知機能は保たれており判断能力に問題はありません。代理決定者として長男がキーパーソンです。",
+    ],
+    "qol": [
+        "治療後のQOLは倦怠感の増悪が懸念されます。日常生活はADL自立ですが呼吸困難が進んでいます。",
+        "QOLの評価は本人の視点を重視したいと考えています。年齢だけで判断しないよう偏見に注意しています。",
+    ],
+    "contextual_features": [
+        "家族の意向として、長男は治療継続、妻は本人の意思を尊重したいと話しています。経済的な負担も気にしています。",
+        "法的な問題は特にありません。施設の方針として在宅移行支援の体制があります。",
+    ],
+}
+MAX_TURNS = 4
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 1)
+
+
+def _summary(values: list[float]) -> dict:
+    if not values:
+        return {}
+    return {
+        "n": len(values),
+        "mean": round(statistics.mean(values), 1),
+        "p50": _percentile(values, 0.5),
+        "p95": _percentile(values, 0.95),
+        "max": round(max(values), 1),
+    }
+
+
+def timed_stream(stream, should_stop=None) -> tuple[float | None, str]:
+    """ストリームを読み切り、最初のチャンクまでの時間(ms)とテキストを返す"""
+    start = time.perf_counter()
+    ttft = None
+    chunks = []
+    try:
+        for chunk in stream:
+            if should_stop is not None and should_stop():
+                break
+            if ttft is None:
+                ttft = (time.perf_counter() - start) * 1000
+            chunks.append(chunk)
+    finally:
+        stream.close()
+    return ttft, "".join(chunks)
+
+
+def run_case(skip_pdf: bool) -> dict:
+    """1ケース分のフローを実行して計測値を返す"""
+    client = EthicsNaviClient()
+    case_overview = SAMPLE_CASE_OVERVIEW
+    ttfts, turns, summaries = [], [], {}
+    case_start = time.perf_counter()
+
+    for quad in QUADRANTS:
+        key = quad["key"]
+        coverage = new_coverage_state(key)
+        ttft, text = timed_stream(client.ask_quadrant_questions_stream(case_overview, key, []))
+        ttfts.append(ttft)
+        conversation = [{"role": "assistant", "content": text}]
+
+        for turn in range(MAX_TURNS):
+            answers = SAMPLE_ANSWERS[key]
+            conversation.append({"role": "user", "content": answers[turn % len(answers)]})
+            turn_start = time.perf_counter()
+            if SPECULATIVE_TURNS:
+                future = client.submit_completion_check(
+                    quadrant_key=key,
+                    conversation=list(conversation),
+                    case_overview=case_overview,
+                    coverage=coverage,
+                )
+                ttft, text = timed_stream(
+                    client.ask_quadrant_questions_stream(
+                        case_overview, key, conversation, coverage["remaining_subtopics"], coverage
+                    ),
+                    should_stop=lambda: future.done() and future.result()["is_complete"],
+                )
+                coverage = future.result()
+            else:
+                coverage = client.check_quadrant_completion(key, conversation, case_overview, coverage)
+                ttft, text = None, ""
+                if not coverage["is_complete"]:
+                    ttft, text = timed_stream(client.ask_quadrant_questions_stream(
+                        case_overview, key, conversation, coverage["remaining_subtopics"], coverage
+                    ))
+            turns.append((time.perf_counter() - turn_start) * 1000)
+            if ttft is not None and not coverage["is_complete"]:
+                ttfts.append(ttft)
+            if coverage["is_complete"]:
+                break
+            conversation.append({"role": "assistant", "content": text})
+        else:
+            # 「この象限を完了して次へ」と同じく、ローカル判定を使わずに要約させる
+            coverage = client.check_quadrant_completion(
+                key, conversation, case_overview, coverage, allow_precheck=False
+            )
+        summaries[key] = coverage.get("summary") or "（未整理）"
+
+    synthesis_start = time.perf_counter()
+    synthesis_first = None
+    table_data = None
+    for event in client.synthesize_table_stream(case_overview, summaries):
+        if synthesis_first is None:
+            synthesis_first = (time.perf_counter() - synthesis_start) * 1000
+        if event["type"] == "done":
+            table_data = event["table_data"]
+    synthesis_ms = (time.perf_counter() - synthesis_start) * 1000
+
+    result = {
+        "case_ms": round((time.perf_counter() - case_start) * 1000, 1),
+        "ttft_ms": ttfts,
+        "turn_ms": turns,
+        "synthesis_first_entry_ms": round(synthesis_first or 0, 1),
+        "synthesis_ms": round(synthesis_ms, 1),
+        "usage": dict(client.usage_totals),
+    }
+
+    if not skip_pdf:
+        from pdf_generator import generate_pdf
+
+        tracemalloc.start()
+        pdf_start = time.perf_counter()
+        generate_pdf(case_overview, table_data)
+        result["pdf_ms"] = round((time.perf_counter() - pdf_start) * 1000, 1)
+        result["pdf_peak_alloc_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+        tracemalloc.stop()
+    return result
+
+
+def run(cases: int, sessions: int, tokens_per_sec: float, ttft_ms: float, skip_pdf: bool) -> dict:
+    server = start_server(0, tokens_per_sec, ttft_ms)
+    os.environ["ANTHROPIC_BASE_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ.setdefault("ANTHROPIC_API_KEY", "sk-ant-benchmark")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as session_pool:
+        results = list(session_pool.map(lambda _: run_case(skip_pdf), range(cases)))
+    wall_ms = (time.perf_counter() - start) * 1000
+    server.shutdown()
+
+    usage_keys = ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")
+    report = {
+        "config": {
+            "cases": cases,
+            "sessions": sessions,
+            "tokens_per_sec": tokens_per_sec,
+            "ttft_ms": ttft_ms,
+        },
+        "wall_ms": round(wall_ms, 1),
+        "case_ms": _summary([r["case_ms"] for r in results]),
+        "ttft_ms": _summary([t for r in results for t in r["ttft_ms"]]),
+        "turn_ms": _summary([t for r in results for t in r["turn_ms"]]),
+        "turns_per_case": _summary([len(r["turn_ms"]) for r in results]),
+        "synthesis_first_entry_ms": _summary([r["synthesis_first_entry_ms"] for r in results]),
+        "synthesis_ms": _summary([r["synthesis_ms"] for r in results]),
+        "tokens_per_case": {k: _summary([r["usage"].get(k, 0) for r in results]) for k in usage_keys},
+        "max_rss_mb": round(_max_rss_mb(), 1),
+    }
+    if not skip_pdf:
+        report["pdf_ms"] = _summary([r["pdf_ms"] for r in results])
+        report["pdf_peak_alloc_mb"] = _summary([r["pdf_peak_alloc_mb"] for r in results])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", type=int, default=3)
+    parser.add_argument("--sessions", type=int, default=1, help="同時に進めるケース数")
+    parser.add_argument("--tokens-per-sec", type=float, default=60.0)
+    parser.add_argument("--ttft-ms", type=float, default=400.0)
+    parser.add_argument("--skip-pdf", action="store_true", help="PDF生成を計測しない")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    args = parser.parse_args()
+
+    report = run(args.cases, args.sessions, args.tokens_per_sec, args.ttft_ms, args.skip_pdf)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"cases={args.cases} sessions={args.sessions} wall={report['wall_ms']}ms RSS={report['max_rss_mb']}MB")
+    print(f"{'metric':<28}{'mean':>10}{'p50':>10}{'p95':>10}{'max':>10}")
+    for name in ("case_ms", "ttft_ms", "turn_ms", "synthesis_first_entry_ms", "synthesis_ms", "pdf_ms", "pdf_peak_alloc_mb"):
+        s = report.get(name)
+        if s:
+            print(f"{name:<28}{s['mean']:>10}{s['p50']:>10}{s['p95']:>10}{s['max']:>10}")
+    for name, s in report["tokens_per_case"].items():
+        print(f"{name:<28}{s['mean']:>10}{s['p50']:>10}{s['p95']:>10}{s['max']:>10}")
+
+
+if __name__ == "__main__":
+    main()
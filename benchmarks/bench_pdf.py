@@ -0,0 +1,125 @@
+"""PDF生成ベンチマーク: フォントキャッシュ有無でのレポートあたりの時間とRSSを比較
+
+使い方:
+    python benchmarks/bench_pdf.py --reports 50
+
+各モードは別プロセスで実行し、プロセスの最大RSSを計測する。
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SAMPLE_CASE_OVERVIEW = (
+    "80代男性、進行性肺癌（ステージIV）。本人は積極的治療を望んでいないが、"
+    "遠方に住む長男は治療継続を強く希望している。認知機能は保たれている。"
+)
+
+SAMPLE_TABLE_DATA = {
+    "table": {
+        "medical_indications": {
+            "診断と予後": "進行性肺癌、多発骨転移あり。予後は数ヶ月と見込まれる。",
+            "治療の目標": "症状緩和と延命のいずれを優先するかでチーム内に議論がある。",
+            "治療の選択肢": "化学療法、放射線療法、緩和ケア単独。",
+            "医学的無益性": "化学療法の効果は限定的との見解がある。",
+        },
+        "patient_preferences": {
+            "患者の希望": "自宅で過ごしたいと繰り返し述べている。",
+            "インフォームドコンセント": "病状説明は本人・家族同席で実施済み。",
+            "判断能力": "認知機能は保たれており、判断能力に問題はないと評価。",
+            "代理決定者": "（未確認）",
+        },
+        "qol": {
+            "治療後のQOL見込み": "化学療法による倦怠感の増悪が懸念される。",
+            "日常生活への影響": "ADLは自立しているが、呼吸困難が徐々に進行。",
+            "QOL評価の主体": "本人の評価と家族の評価に相違がある。",
+            "偏見の排除": "年齢のみを理由とした判断になっていないか確認が必要。",
+        },
+        "contextual_features": {
+            "家族の意向": "長男は治療継続を希望、妻は本人の意向を尊重したいと述べる。",
+            "経済的問題": "（未確認）",
+            "法的問題": "特記事項なし。",
+            "施設の方針": "在宅移行支援の体制はある。",
+        },
+    },
+    "discussion_points": [
+        "本人の「自宅で過ごしたい」という希望は、どの程度具体的に確認されているか？",
+        "長男の希望の背景にはどのような思いがあるか？",
+        "化学療法の見込まれる効果と負担は、本人にどのように伝わっているか？",
+    ],
+    "tensions": [
+        "患者の意向（自宅療養）と家族の意向（治療継続）の間に緊張関係がある。",
+    ],
+}
+
+
+def _max_rss_mb() -> float:
+    # Linux は KiB、macOS はバイト単位
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_mode(mode: str, reports: int) -> dict:
+    import pdf_generator
+
+    pdf_generator.PDF_FONT_CACHE = mode == "cached"
+
+    timings = []
+    for _ in range(reports):
+        start = time.perf_counter()
+        pdf_generator.generate_pdf(SAMPLE_CASE_OVERVIEW, SAMPLE_TABLE_DATA)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    ordered = sorted(timings)
+    return {
+        "mode": mode,
+        "reports": reports,
+        "first_ms": round(timings[0], 1),
+        "mean_ms": round(statistics.mean(timings), 1),
+        "p50_ms": round(ordered[len(ordered) // 2], 1),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+        "max_rss_mb": round(_max_rss_mb(), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reports", type=int, default=30)
+    parser.add_argument("--mode", choices=["cached", "uncached"])
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.reports)))
+        return
+
+    results = []
+    for mode in ("uncached", "cached"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, "--reports", str(args.reports)],
+            check=True, capture_output=True, text=True,
+        )
+        results.append(json.loads(out.stdout))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'mode':<10}{'first':>10}{'mean':>10}{'p50':>10}{'p95':>10}{'RSS(MB)':>10}")
+    for r in results:
+        print(
+            f"{r['mode']:<10}{r['first_ms']:>10}{r['mean_ms']:>10}"
+            f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['max_rss_mb']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""ベンチマーク用のローカルな Messages API の代替サーバー
+
+使い方:
+    python benchmarks/fake_anthropic.py --port 8089 --tokens-per-sec 60 --ttft-ms 400
+
+POST /v1/messages に対して、プロンプトの種類（完了チェック・統合・象限ごとの構造化・質問生成）に応じた
+応答を返す。stream=true なら SSE で少しずつ送り、指定したトークン速度と
+最初のトークンまでの遅延を再現する。トークン数は入出力ともテキスト部分だけを
+tokens.estimate_tokens で概算する。cache_control の付いたブロックまでの接頭辞は
+サーバー内で覚え、同じ接頭辞の2回目以降をキャッシュ読み込みとして使用量に計上する。
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import QUADRANTS  # noqa: E402
+from tokens import estimate_tokens  # noqa: E402
+
+# ストリームの1イベントで送る文字数
+CHARS_PER_EVENT = 2
+# これより短い接頭辞はキャッシュされない（Messages API の最小キャッシュ長）
+CACHE_MIN_TOKENS = 1024
+
+QUESTION_TEXT = (
+    "ご回答ありがとうございます。ここまでの内容を整理すると、"
+    "本人の意向と治療方針について、チーム内でいくつかの見方があるようです。\n\n"
+    "1. その点について、本人はどのような言葉で気持ちを表現されていましたか？\n"
+    "2. ご家族は、現在の病状をどのように受け止めていらっしゃいますか？\n"
+    "3. チーム内で見解が分かれている点があれば、具体的にお聞かせください。"
+)
+
+
+def _prompt_text(body: dict) -> str:
+    """最後のユーザー発話のテキスト"""
+    for message in reversed(body.get("messages", [])):
+        if message["role"] != "user":
+            continue
+        content = message["content"]
+        if isinstance(content, str):
+            return content
+        return "".join(block.get("text", "") for block in content)
+    return ""
+
+
+def _completion_response(prompt: str) -> str:
+    """前回までの整理済みサブトピックに2つずつ加えていく完了チェック応答"""
+    quad = next((q for q in QUADRANTS if f"「{q['title_ja']}」" in prompt), QUADRANTS[0])
+    covered = []
+    match = re.search(r"これまでの整理状況:\n(.*?)\n\n新しい対話内容", prompt, re.S)
+    if match:
+        try:
+            covered = json.loads(match.group(1)).get("covered_subtopics", [])
+        except json.JSONDecodeError:
+            pass
+    remaining = [s for s in quad["subtopics"] if s not in covered]
+    covered = covered + remaining[:2]
+    remaining = remaining[2:]
+    return json.dumps({
+        "is_complete": not remaining,
+        "covered_subtopics": covered,
+        "remaining_subtopics": remaining,
+        "partial_notes": {s: "一部のみ言及あり" for s in remaining[:1]},
+        "summary": f"{quad['title_ja']}について、{'、'.join(covered)}が整理された。",
+    }, ensure_ascii=False, indent=2)
+
+
+def _quadrant_table(quad: dict) -> dict:
+    return {s: f"{s}について対話で得られた事実を整理した内容。" for s in quad["subtopics"]}
+
+
+def _quadrant_synthesis_response(prompt: str) -> str:
+    """象限ごとの構造化（並列統合）の応答"""
+    quad = next((q for q in QUADRANTS if f"「{q['title_ja']}」" in prompt), QUADRANTS[0])
+    return json.dumps(_quadrant_table(quad), ensure_ascii=False, indent=2)
+
+
+def _synthesis_response(with_table: bool = True) -> str:
+    """統合の応答。with_table=False なら検討ポイントと緊張関係のみ（並列統合の最後の呼び出し）"""
+    table = {"table": {q["key"]: _quadrant_table(q) for q in QUADRANTS}} if with_table else {}
+    return json.dumps({
+        **table,
+        "discussion_points": [
+            "本人の意向はどの程度具体的に確認されているか？",
+            "家族の希望の背景にはどのような思いがあるか？",
+            "治療の効果と負担は本人にどのように伝わっているか？",
+        ],
+        "tensions": ["患者の意向と家族の意向の間に緊張関係がある。"],
+    }, ensure_ascii=False, indent=2)
+
+
+def response_text(body: dict) -> str:
+    """リクエストの種類に応じた応答テキスト（途中までのアシスタント発話があれば続きだけ）"""
+    prompt = _prompt_text(body)
+    if '"is_complete"' in prompt:
+        text = _completion_response(prompt)
+    elif '"discussion_points"' in prompt:
+        text = _synthesis_response(with_table='"table"' in prompt)
+    elif "整理された内容" in prompt:
+        text = _quadrant_synthesis_response(prompt)
+    else:
+        text = QUESTION_TEXT
+    last = body.get("messages", [])[-1:]
+    if last and last[0]["role"] == "assistant" and isinstance(last[0]["content"], str):
+        prefix = last[0]["content"]
+        text = text[len(prefix):] if text.startswith(prefix) else text
+    return text
+
+
+def _blocks(body: dict) -> list[tuple[str, str, bool]]:
+    """キャッシュの接頭辞になる順（system → messages）のブロック: (役割, テキスト, cache_control の有無)"""
+    system = body.get("system") or []
+    if isinstance(system, str):
+        system = [{"type": "text", "text": system}]
+    blocks = [("system", b.get("text", ""), "cache_control" in b) for b in system]
+    for message in body.get("messages", []):
+        content = message["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        blocks.extend((message["role"], b.get("text", ""), "cache_control" in b) for b in content)
+    return blocks
+
+
+def _usage(body: dict, output_text: str, prompt_cache: set) -> dict:
+    """入出力トークン数と、キャッシュの読み込み・書き込み分
+
+    最も長い既知のキャッシュ接頭辞を読み込みとし、最後のブレークポイントまでの残りを書き込みとする。
+    """
+    digest = hashlib.sha256(body.get("model", "").encode())
+    total = 0
+    breakpoints = []
+    for role, text, cached in _blocks(body):
+        digest.update(f"{role}\0{text}\0".encode())
+        total += estimate_tokens(text)
+        if cached and total >= CACHE_MIN_TOKENS:
+            breakpoints.append((digest.hexdigest(), total))
+
+    read = written = 0
+    with _cache_lock:
+        for key, tokens in reversed(breakpoints):
+            if key in prompt_cache:
+                read = tokens
+                break
+        if breakpoints and breakpoints[-1][1] > read:
+            written = breakpoints[-1][1] - read
+        prompt_cache.update(key for key, _ in breakpoints)
+    return {
+        "input_tokens": total - read - written,
+        "output_tokens": max(1, estimate_tokens(output_text)),
+        "cache_creation_input_tokens": written,
+        "cache_read_input_tokens": read,
+    }
+
+
+_cache_lock = threading.Lock()
+
+
+class FakeMessagesHandler(BaseHTTPRequestHandler):
+    tokens_per_sec = 60.0
+    ttft_ms = 400.0
+    # キャッシュ済みの接頭辞のハッシュ（サーバーごと）
+    prompt_cache: set = set()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.startswith("/v1/messages"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        text = response_text(body)
+        usage = _usage(body, text, self.prompt_cache)
+        message = {
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "fake"),
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+        }
+
+        time.sleep(self.ttft_ms / 1000)
+        if not body.get("stream"):
+            time.sleep(usage["output_tokens"] / self.tokens_per_sec)
+            payload = json.dumps({
+                **message, "content": [{"type": "text", "text": text}], "usage": usage,
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            self._event("message_start", {
+                "type": "message_start",
+                "message": {
+                    **message, "content": [], "stop_reason": None,
+                    "usage": {**usage, "output_tokens": 1},
+                },
+            })
+            self._event("content_block_start", {
+                "type": "content_block_start", "index": 0,
+                "content_block": {"type": "text", "text": ""},
+            })
+            for i in range(0, len(text), CHARS_PER_EVENT):
+                chunk = text[i:i + CHARS_PER_EVENT]
+                self._event("content_block_delta", {
+                    "type": "content_block_delta", "index": 0,
+                    "delta": {"type": "text_delta", "text": chunk},
+                })
+                time.sleep(estimate_tokens(chunk) / self.tokens_per_sec)
+            self._event("content_block_stop", {"type": "content_block_stop", "index": 0})
+            self._event("message_delta", {
+                "type": "message_delta",
+                "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                "usage": {"output_tokens": usage["output_tokens"]},
+            })
+            self._event("message_stop", {"type": "message_stop"})
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントがストリームを打ち切った
+            pass
+
+    def _event(self, name: str, data: dict):
+        self.wfile.write(f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+        self.wfile.flush()
+
+
+def start_server(
+    port: int = 0,
+    tokens_per_sec: float = 60.0,
+    ttft_ms: float = 400.0,
+) -> ThreadingHTTPServer:
+    """別スレッドでサーバーを起動する。port=0 なら空いているポートを使う"""
+    handler = type("Handler", (FakeMessagesHandler,), {
+        "tokens_per_sec": tokens_per_sec,
+        "ttft_ms": ttft_ms,
+        "prompt_cache": set(),
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-anthropic", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--tokens-per-sec", type=float, default=60.0)
+    parser.add_argument("--ttft-ms", type=float, default=400.0)
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.tokens_per_sec, args.ttft_ms)
+    print(f"ANTHROPIC_BASE_URL=http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
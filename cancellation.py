@@ -0,0 +1,69 @@
+"""セッション単位の呼び出しの取り消し（画面を離れたら実行中の API 呼び出しを中断する）"""
+
+import logging
+import threading
+import weakref
+from concurrent.futures import Future
+
+from telemetry import CANCELLATIONS
+
+logger = logging.getLogger(__name__)
+
+
+class CancelToken:
+    """実行中の呼び出し（concurrent.futures.Future）を登録し、cancel() でまとめて中断する
+
+    child() で作ったトークンの呼び出しは、親の cancel() でも中断される。
+    取り消したトークン（と子）は取り消されたままで、後から登録した呼び出しもすぐに中断する
+    （ストリームの1チャンクごとの呼び出しが、取り消しの直後に始まっても続かないようにする）。
+    """
+
+    def __init__(self, parent: "CancelToken | None" = None):
+        self._lock = threading.Lock()
+        self._futures: set[Future] = set()
+        self._children: weakref.WeakSet = weakref.WeakSet()
+        self.cancelled = False
+        self._reason = ""
+        if parent is not None:
+            with parent._lock:
+                parent._children.add(self)
+                self.cancelled = parent.cancelled
+                self._reason = parent._reason
+
+    def child(self) -> "CancelToken":
+        return CancelToken(self)
+
+    def register(self, future: Future):
+        """実行中の呼び出しを登録する（終わったものは自動的に外れる）。取り消し済みならすぐに中断する"""
+        with self._lock:
+            cancelled = self.cancelled
+            if not cancelled:
+                self._futures.add(future)
+        if cancelled:
+            if future.cancel():
+                _count(self._reason, 1)
+            return
+        future.add_done_callback(self._discard)
+
+    def _discard(self, future: Future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def _cancel(self, reason: str) -> int:
+        with self._lock:
+            self.cancelled = True
+            self._reason = reason
+            futures = list(self._futures)
+            children = list(self._children)
+        return sum(1 for f in futures if f.cancel()) + sum(c._cancel(reason) for c in children)
+
+    def cancel(self, reason: str) -> int:
+        """実行中の呼び出しを中断し、中断した数を返す"""
+        return _count(reason, self._cancel(reason))
+
+
+def _count(reason: str, aborted: int) -> int:
+    if aborted:
+        CANCELLATIONS.inc(aborted, reason=reason)
+        logger.info("calls_cancelled reason=%s count=%d", reason, aborted)
+    return aborted
@@ -0,0 +1,222 @@
+"""完了したケースを保存・全文検索するローカルの SQLite アーカイブ"""
+
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from config import CASE_ARCHIVE_PATH, CASE_ARCHIVE_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# 一覧に表示するケース概要の長さ（文字）
+_PREVIEW_CHARS = 120
+# 索引の形式（変えたら既存のケースを索引し直す。PRAGMA user_version に記録）
+_INDEX_VERSION = 1
+
+
+def _runs(text: str) -> list[str]:
+    """正規化したテキストを、文字・数字の連続ごとに区切る"""
+    runs, current = [], []
+    for c in unicodedata.normalize("NFKC", text).lower():
+        if c.isalnum():
+            current.append(c)
+        elif current:
+            runs.append("".join(current))
+            current = []
+    if current:
+        runs.append("".join(current))
+    return runs
+
+
+def _bigrams(run: str) -> list[str]:
+    if len(run) < 2:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def _index_grams(run: str) -> list[str]:
+    """索引に入れる語（2文字ずつの並びと、末尾の1文字）
+
+    1文字の検索語は前方一致で探すため、末尾の1文字も入れておかないと
+    連続の最後にある文字（「肺癌」の「癌」など）が見つからない。
+    """
+    grams = _bigrams(run)
+    if len(run) >= 2:
+        grams.append(run[-1])
+    return grams
+
+
+def ngram_text(text: str) -> str:
+    """索引用に、文字の連続を重なりのある2文字ずつに分けて空白で区切る
+
+    日本語は単語の区切りがないため、FTS5 の unicode61 トークナイザが
+    2文字の語をそれぞれ1トークンとして扱えるようにする。
+    """
+    return " ".join(gram for run in _runs(text) for gram in _index_grams(run))
+
+
+def ngram_query(query: str) -> str | None:
+    """検索語を FTS5 の MATCH 式にする（空白区切りの語はすべてを含むケースを探す）
+
+    2文字以上の語は連続した2文字の並びのフレーズ、1文字の語は前方一致で探す。
+    """
+    terms = []
+    for run in _runs(query):
+        if len(run) == 1:
+            terms.append(f'"{run}"*')
+        else:
+            terms.append('"' + " ".join(_bigrams(run)) + '"')
+    return " AND ".join(terms) or None
+
+
+def _search_text(record: dict) -> str:
+    """索引に含める内容（ケース概要・象限の要約・4分割表）"""
+    parts = [record["case_overview"]]
+    parts.extend(v for v in record.get("quadrant_summaries", {}).values() if v)
+    table_data = record.get("full_table_data") or {}
+    for cells in table_data.get("table", {}).values():
+        parts.extend(f"{k} {v}" for k, v in cells.items())
+    parts.extend(table_data.get("discussion_points", []))
+    parts.extend(table_data.get("tensions", []))
+    return "\n".join(parts)
+
+
+class CaseArchive:
+    """ケースの保存（書き込みは専用スレッドで後から行う）と検索"""
+
+    def __init__(self, path: str = CASE_ARCHIVE_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = self._connect()
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS cases ("
+            " id INTEGER PRIMARY KEY, case_id TEXT NOT NULL UNIQUE, saved REAL NOT NULL,"
+            " case_overview TEXT NOT NULL, data TEXT NOT NULL);"
+            "CREATE VIRTUAL TABLE IF NOT EXISTS cases_fts USING fts5("
+            " body, tokenize='unicode61 remove_diacritics 0');"
+        )
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < _INDEX_VERSION:
+            self._reindex()
+        self._lock = threading.Lock()
+        self._pending: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="ethicsnavi-archive", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reindex(self):
+        """保存済みのケースを現在の形式で索引し直す"""
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM cases_fts")
+            rows = self._conn.execute("SELECT id, data FROM cases").fetchall()
+            self._conn.executemany(
+                "INSERT INTO cases_fts (rowid, body) VALUES (?, ?)",
+                [(rowid, ngram_text(_search_text(json.loads(data)))) for rowid, data in rows],
+            )
+            self._conn.execute(f"PRAGMA user_version = {_INDEX_VERSION}")
+        logger.info("case_archive_reindex cases=%d version=%d", len(rows), _INDEX_VERSION)
+
+    def save(self, case_id: str, record: dict):
+        """ケースの保存を予約する（同じ case_id は上書き）。書き込みは待たない
+
+        保存するのは呼び出した時点の内容（後からセッションが変わっても影響しない）。
+        """
+        self._pending.put((case_id, time.time(), json.dumps(record, ensure_ascii=False)))
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self._pending.get()]
+            while True:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(conn, batch)
+            except sqlite3.Error as e:
+                logger.warning("case_archive_write_failed cases=%d error=%s", len(batch), e)
+
+    def _write(self, conn: sqlite3.Connection, batch: list[tuple]):
+        with conn:
+            conn.execute("BEGIN")
+            for case_id, saved, data in batch:
+                record = json.loads(data)
+                row = conn.execute("SELECT id FROM cases WHERE case_id = ?", (case_id,)).fetchone()
+                if row is None:
+                    rowid = conn.execute(
+                        "INSERT INTO cases (case_id, saved, case_overview, data) VALUES (?, ?, ?, ?)",
+                        (case_id, saved, record["case_overview"], data),
+                    ).lastrowid
+                else:
+                    rowid = row[0]
+                    conn.execute(
+                        "UPDATE cases SET saved = ?, case_overview = ?, data = ? WHERE id = ?",
+                        (saved, record["case_overview"], data, rowid),
+                    )
+                    conn.execute("DELETE FROM cases_fts WHERE rowid = ?", (rowid,))
+                conn.execute(
+                    "INSERT INTO cases_fts (rowid, body) VALUES (?, ?)",
+                    (rowid, ngram_text(_search_text(record))),
+                )
+        logger.info("case_archive_write cases=%d", len(batch))
+
+    def search(self, query: str = "", page: int = 0, page_size: int = CASE_ARCHIVE_PAGE_SIZE) -> dict:
+        """新しく保存した順にケースを検索する（query が空なら全件）
+
+        {"items": [{"case_id", "saved", "preview"}, ...], "has_more": bool} を返す。
+        """
+        match = ngram_query(query)
+        offset = page * page_size
+        with self._lock:
+            if match is None:
+                rows = self._conn.execute(
+                    "SELECT case_id, saved, case_overview FROM cases"
+                    " ORDER BY id DESC LIMIT ? OFFSET ?",
+                    (page_size + 1, offset),
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT c.case_id, c.saved, c.case_overview FROM"
+                    " (SELECT rowid FROM cases_fts WHERE cases_fts MATCH ?"
+                    "  ORDER BY rowid DESC LIMIT ? OFFSET ?) AS f"
+                    " JOIN cases AS c ON c.id = f.rowid ORDER BY c.id DESC",
+                    (match, page_size + 1, offset),
+                ).fetchall()
+        return {
+            "items": [
+                {"case_id": case_id, "saved": saved, "preview": overview[:_PREVIEW_CHARS]}
+                for case_id, saved, overview in rows[:page_size]
+            ],
+            "has_more": len(rows) > page_size,
+        }
+
+    def load(self, case_id: str) -> dict | None:
+        """保存したケースの内容"""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM cases WHERE case_id = ?", (case_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+_case_archive: CaseArchive | None = None
+_case_archive_lock = threading.Lock()
+
+
+def get_case_archive() -> CaseArchive:
+    """プロセス共有のケースアーカイブを取得"""
+    global _case_archive
+    with _case_archive_lock:
+        if _case_archive is None:
+            _case_archive = CaseArchive()
+        return _case_archive
@@ -1,132 +1,1027 @@
 """Anthropic SDK ラッパー"""
 
+import asyncio
 import json
+import logging
+import random
+import threading
+from collections.abc import AsyncIterator, Iterator
+from concurrent.futures import CancelledError, Future
+from contextlib import asynccontextmanager
+
 import anthropic
+import httpx
 from dotenv import load_dotenv
 
-from config import MODEL, MAX_TOKENS, TEMPERATURE, QUADRANTS
+from config import (
+    MODEL_ROUTES,
+    QUADRANTS,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    PRECHECK_ENABLED,
+    PRECHECK_SHADOW_RATE,
+    COMPACTION_TOKEN_BUDGET,
+    JSON_REPAIR_RETRY,
+    FORBIDDEN_PHRASE_GUARD,
+    GUARD_MAX_REGENERATIONS,
+    RESPONSE_CACHE_ENABLED,
+    SYNTHESIS_FAN_OUT,
+)
+from coverage import (
+    new_coverage_state,
+    pending_messages,
+    format_state,
+    format_exchange,
+    updated_state,
+    precheck,
+)
 from prompts import (
     SYSTEM_PROMPT,
+    CASE_OVERVIEW_CONTEXT,
     QUADRANT_START_PROMPT,
     QUADRANT_FOLLOWUP_PROMPT,
     QUADRANT_COMPLETION_CHECK_PROMPT,
     SYNTHESIS_PROMPT,
-    validate_response,
+    QUADRANT_SYNTHESIS_PROMPT,
+    CROSS_QUADRANT_PROMPT,
+    JSON_MISSING_FIELDS_PROMPT,
+    FORBIDDEN_MATCHER,
+    FORBIDDEN_PHRASE_REMINDER,
+)
+from json_extract import (
+    JSONExtractError,
+    JSONStreamParser,
+    extract_json,
+    missing_fields,
+    merge_json,
 )
+from phrase_guard import StreamGuard
+from stream_coalesce import ChunkCoalescer
+from cancellation import CancelToken
+from response_cache import ResponseCache, get_response_cache, response_cache_key
+from telemetry import CallSpan, PARSE_FAILURES, STREAM_CHUNKS, call_span, record_tokens
+from scheduler import RequestScheduler, get_scheduler
+from tokens import estimate_request_tokens, truncate_to_tokens
+from compaction import compact_conversation
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
 
-class EthicsNaviClient:
-    def __init__(self):
-        self.client = anthropic.Anthropic()
 
-    def ask_quadrant_questions_stream(
+_http_client: httpx.AsyncClient | None = None
+_http_client_lock = threading.Lock()
+
+
+def get_shared_http_client() -> httpx.AsyncClient:
+    """プロセス共有のHTTP接続プールを取得（keep-aliveで接続を使い回す）"""
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = anthropic.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            )
+        return _http_client
+
+
+def _find_quadrant(quadrant_key: str) -> dict:
+    return next(q for q in QUADRANTS if q["key"] == quadrant_key)
+
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def _system_blocks(case_overview: str) -> list[dict]:
+    """システムプロンプトとケース概要をキャッシュ可能なブロックとして組み立てる
+
+    ケース内の全呼び出しで同じ接頭辞になるよう、ケース概要はユーザー側の
+    指示文ではなくシステム側に置き、それぞれの直後にブレークポイントを置く。
+    """
+    blocks = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": CACHE_CONTROL}]
+    if case_overview:
+        blocks.append({
+            "type": "text",
+            "text": CASE_OVERVIEW_CONTEXT.format(case_overview=case_overview),
+            "cache_control": CACHE_CONTROL,
+        })
+    return blocks
+
+
+def _with_cache_breakpoint(conversation: list[dict]) -> list[dict]:
+    """確定済みの最後のターンにブレークポイントを置いた会話のコピーを返す"""
+    if not conversation:
+        return []
+    *settled, last = conversation
+    return settled + [{
+        "role": last["role"],
+        "content": [{"type": "text", "text": last["content"], "cache_control": CACHE_CONTROL}],
+    }]
+
+
+def _usage_dict(usage) -> dict:
+    return {
+        "input_tokens": usage.input_tokens,
+        "output_tokens": usage.output_tokens,
+        "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+        "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+    }
+
+
+def _synthesis_event(path: tuple, value) -> dict | None:
+    """統合結果の確定値をUI向けのイベントに変換"""
+    if len(path) == 3 and path[0] == "table" and isinstance(value, str):
+        return {"type": "entry", "quadrant": path[1], "subtopic": path[2], "text": value}
+    if len(path) == 2 and path[0] == "discussion_points" and isinstance(value, str):
+        return {"type": "discussion_point", "text": value}
+    if len(path) == 2 and path[0] == "tensions" and isinstance(value, str):
+        return {"type": "tension", "text": value}
+    return None
+
+
+def _table_from_events(events: list[dict]) -> dict:
+    """途中までのイベントから統合結果を組み立てる（最終JSONが壊れていた場合用）"""
+    table_data = {"table": {}, "discussion_points": [], "tensions": []}
+    for event in events:
+        if event["type"] == "entry":
+            table_data["table"].setdefault(event["quadrant"], {})[event["subtopic"]] = event["text"]
+        elif event["type"] == "discussion_point":
+            table_data["discussion_points"].append(event["text"])
+        else:
+            table_data["tensions"].append(event["text"])
+    return table_data
+
+
+def _route_params(route: str) -> dict:
+    """ルートの出力トークン上限と temperature（リクエストと応答キャッシュのキーに含める）"""
+    settings = MODEL_ROUTES[route]
+    return {"max_tokens": settings["max_tokens"], "temperature": settings["temperature"]}
+
+
+def _response_text(response) -> str:
+    return "".join(block.text for block in response.content if block.type == "text")
+
+
+# 応答種別ごとの必須フィールド（欠けていればその部分だけ再リクエストする）
+COMPLETION_CHECK_SCHEMA = {
+    "is_complete": bool,
+    "covered_subtopics": list,
+    "remaining_subtopics": list,
+    "partial_notes": dict,
+    "summary": str,
+}
+
+SYNTHESIS_SCHEMA = {
+    "table": {q["key"]: {s: str for s in q["subtopics"]} for q in QUADRANTS},
+    "discussion_points": list,
+    "tensions": list,
+}
+
+CROSS_QUADRANT_SCHEMA = {
+    "discussion_points": list,
+    "tensions": list,
+}
+
+SYNTHESIS_ERROR_POINT = "データの解析に失敗しました。再度お試しください。"
+
+
+class AsyncEthicsNaviClient:
+    """EthicsNaviClient の非同期版。全インスタンスで1つの接続プールを共有する"""
+
+    def __init__(
+        self,
+        http_client: httpx.AsyncClient | None = None,
+        response_cache: ResponseCache | None = None,
+        scheduler: RequestScheduler | None = None,
+    ):
+        # 再試行は SDK ではなく、全セッション共有のスケジューラが行う
+        self.client = anthropic.AsyncAnthropic(
+            http_client=http_client or get_shared_http_client(),
+            max_retries=0,
+        )
+        self.scheduler = scheduler or get_scheduler()
+        if response_cache is None and RESPONSE_CACHE_ENABLED:
+            response_cache = get_response_cache()
+        self.response_cache = response_cache
+        # 呼び出し種別ごとの直近のトークン使用量と累計（キャッシュ読み書きを含む）
+        self.last_usage: dict[str, dict] = {}
+        self.usage_totals: dict[str, int] = {}
+        # 呼び出し種別ごとの応答キャッシュのヒット・ミス数
+        self.response_cache_counts: dict[str, dict[str, int]] = {}
+        self._background_tasks: set[asyncio.Task] = set()
+
+    def _record_usage(self, call_type: str, usage) -> None:
+        record = _usage_dict(usage)
+        self.last_usage[call_type] = record
+        record_tokens(call_type, record)
+        self.scheduler.record_output(record["output_tokens"])
+        for k, v in record.items():
+            self.usage_totals[k] = self.usage_totals.get(k, 0) + v
+
+    async def _create(self, span: CallSpan, route: str, **request):
+        """スケジューラを通して、ルートのモデルとタイムアウトで messages.create を呼ぶ"""
+        settings = MODEL_ROUTES[route]
+        span.set_route(route, settings["model"])
+
+        async def send():
+            raw = await self.client.messages.with_raw_response.create(
+                model=settings["model"], timeout=settings["timeout"], **request
+            )
+            self.scheduler.observe_headers(raw.headers)
+            return raw.parse()
+
+        input_tokens = estimate_request_tokens(request["system"], request["messages"])
+        return await self.scheduler.call(span.call_type, input_tokens, send)
+
+    @asynccontextmanager
+    async def _stream(self, span: CallSpan, route: str, **request):
+        """スケジューラを通してストリームを開く（最初の応答までのエラーは再試行する）"""
+        settings = MODEL_ROUTES[route]
+        span.set_route(route, settings["model"])
+
+        async def open_stream():
+            return await self.client.messages.stream(
+                model=settings["model"], timeout=settings["timeout"], **request
+            ).__aenter__()
+
+        input_tokens = estimate_request_tokens(request["system"], request["messages"])
+        stream = await self.scheduler.call(span.call_type, input_tokens, open_stream)
+        self.scheduler.observe_headers(stream.response.headers)
+        try:
+            yield stream
+        finally:
+            await stream.close()
+
+    def _cache_lookup(self, call_type: str, key: str) -> str | None:
+        if self.response_cache is None:
+            return None
+        cached = self.response_cache.get(key)
+        counts = self.response_cache_counts.setdefault(call_type, {"hits": 0, "misses": 0})
+        counts["hits" if cached is not None else "misses"] += 1
+        return cached
+
+    def _cache_store(self, key: str, result: dict):
+        if self.response_cache is not None:
+            self.response_cache.put(key, json.dumps(result, ensure_ascii=False))
+
+    def response_cache_stats(self) -> dict[str, dict]:
+        """呼び出し種別ごとの応答キャッシュのヒット率"""
+        return {
+            call_type: {
+                **counts,
+                "hit_rate": counts["hits"] / (counts["hits"] + counts["misses"]),
+            }
+            for call_type, counts in self.response_cache_counts.items()
+        }
+
+    async def _complete_json(
+        self,
+        span: CallSpan,
+        case_overview: str,
+        prompt: str,
+        route: str,
+        parser: JSONStreamParser,
+        schema: dict,
+    ) -> dict:
+        """JSON応答を取り出し、途中で切れた・欠けた部分だけを再リクエストして補う
+
+        出力トークンの上限で切れていれば、途中までの応答をアシスタントの発話として渡して続きを生成させる。
+        スキーマの必須フィールドが欠けていれば、そのフィールドだけを改めて尋ねる。
+        取り出せない場合は JSONExtractError を送出する。
+        """
+        call_type = span.call_type
+        if JSON_REPAIR_RETRY and parser.truncated:
+            span.retry("continuation")
+            response = await self._create(
+                span,
+                route,
+                **_route_params(route),
+                system=_system_blocks(case_overview),
+                messages=[
+                    {"role": "user", "content": prompt},
+                    {"role": "assistant", "content": parser.text.rstrip()},
+                ],
+            )
+            self._record_usage(call_type, response.usage)
+            continued = JSONStreamParser()
+            try:
+                continued.feed(parser.text.rstrip() + _response_text(response))
+            except JSONExtractError:
+                PARSE_FAILURES.inc(call_type=call_type)
+                raise
+            logger.info("json_repair call=%s kind=continuation done=%s", call_type, continued.done)
+            parser = continued
+
+        try:
+            result = parser.result()
+        except (JSONExtractError, json.JSONDecodeError) as e:
+            PARSE_FAILURES.inc(call_type=call_type)
+            raise JSONExtractError(str(e)) from e
+
+        missing = missing_fields(result, schema)
+        if JSON_REPAIR_RETRY and missing:
+            span.retry("missing_fields")
+            fields = "\n".join("- " + ".".join(str(k) for k in path) for path in missing)
+            response = await self._create(
+                span,
+                route,
+                **_route_params(route),
+                system=_system_blocks(case_overview),
+                messages=[
+                    {"role": "user", "content": prompt},
+                    {"role": "assistant", "content": json.dumps(result, ensure_ascii=False)},
+                    {"role": "user", "content": JSON_MISSING_FIELDS_PROMPT.format(fields=fields)},
+                ],
+            )
+            self._record_usage(call_type, response.usage)
+            try:
+                result = merge_json(result, extract_json(_response_text(response)))
+            except (JSONExtractError, json.JSONDecodeError):
+                PARSE_FAILURES.inc(call_type=call_type)
+            logger.info(
+                "json_repair call=%s kind=missing_fields requested=%d still_missing=%d",
+                call_type, len(missing), len(missing_fields(result, schema)),
+            )
+        return result
+
+    async def ask_quadrant_questions_stream(
         self,
         case_overview: str,
         quadrant_key: str,
         conversation: list[dict],
         remaining_subtopics: list[str] | None = None,
-    ):
-        """象限の深掘り質問をストリーミングで生成"""
-        quad = next(q for q in QUADRANTS if q["key"] == quadrant_key)
+        coverage: dict | None = None,
+    ) -> AsyncIterator[str]:
+        """象限の深掘り質問をストリーミングで生成
+
+        coverage（完了チェックの整理状況）を渡すと、長くなった会話の古いターンを要約に置き換える。
+        細かいチャンクは ChunkCoalescer でまとめてから返す（画面の更新回数を減らす）。
+        """
+        with call_span("question") as span:
+            coalescer = ChunkCoalescer()
+            try:
+                async for text in self._question_stream(
+                    span, case_overview, quadrant_key, conversation, remaining_subtopics, coverage
+                ):
+                    if released := coalescer.feed(text):
+                        span.first_token()
+                        yield released
+                if tail := coalescer.flush():
+                    yield tail
+            finally:
+                STREAM_CHUNKS.inc(coalescer.received, call_type=span.call_type, kind="received")
+                STREAM_CHUNKS.inc(coalescer.emitted, call_type=span.call_type, kind="emitted")
+                logger.info(
+                    "stream_coalesce call=%s received=%d emitted=%d",
+                    span.call_type, coalescer.received, coalescer.emitted,
+                )
+
+    async def prefetch_opening_question(self, case_overview: str, quadrant_key: str) -> str:
+        """象限の最初の質問を最後まで生成して返す（先行生成用）
+
+        画面に表示中の対話より後に回すため、スケジューラでは opening_prefetch の優先度で扱う。
+        """
+        with call_span("opening_prefetch") as span:
+            chunks = []
+            async for text in self._question_stream(span, case_overview, quadrant_key, [], None, None):
+                span.first_token()
+                chunks.append(text)
+            return "".join(chunks)
+
+    async def _question_stream(
+        self,
+        span: CallSpan,
+        case_overview: str,
+        quadrant_key: str,
+        conversation: list[dict],
+        remaining_subtopics: list[str] | None,
+        coverage: dict | None,
+    ) -> AsyncIterator[str]:
+        quad = _find_quadrant(quadrant_key)
 
         if len(conversation) == 0:
+            route = "opening_question"
             user_content = QUADRANT_START_PROMPT.format(
                 quadrant_title=quad["title_ja"],
-                case_overview=case_overview,
                 subtopics="、".join(quad["subtopics"]),
             )
             messages = [{"role": "user", "content": user_content}]
         else:
+            route = "followup_question"
             if remaining_subtopics is None:
                 remaining_subtopics = quad["subtopics"]
             user_content = QUADRANT_FOLLOWUP_PROMPT.format(
                 quadrant_title=quad["title_ja"],
-                case_overview=case_overview,
                 remaining_subtopics="、".join(remaining_subtopics),
             )
-            messages = conversation + [{"role": "user", "content": user_content}]
-
-        with self.client.messages.stream(
-            model=MODEL,
-            max_tokens=MAX_TOKENS,
-            temperature=TEMPERATURE,
-            system=SYSTEM_PROMPT,
-            messages=messages,
-        ) as stream:
-            for text in stream.text_stream:
-                yield text
+            instruction = {"role": "user", "content": user_content}
+            reserved = estimate_request_tokens(_system_blocks(case_overview), [instruction])
+            messages = _with_cache_breakpoint(
+                compact_conversation(conversation, coverage, reserved)
+            ) + [instruction]
 
-    def check_quadrant_completion(
+        if not FORBIDDEN_PHRASE_GUARD:
+            async with self._stream(
+                span,
+                route,
+                **_route_params(route),
+                system=_system_blocks(case_overview),
+                messages=messages,
+            ) as stream:
+                async for text in stream.text_stream:
+                    yield text
+                self._record_usage(span.call_type, (await stream.get_final_message()).usage)
+            return
+
+        # 禁止表現を検出したらストリームを打ち切り、表示済みのテキストを
+        # アシスタントの発話として渡して、その直前から続きを生成し直す
+        guard = StreamGuard(FORBIDDEN_MATCHER)
+        emitted = ""
+        request_messages = messages
+        for attempt in range(GUARD_MAX_REGENERATIONS + 1):
+            async with self._stream(
+                span,
+                route,
+                **_route_params(route),
+                system=_system_blocks(case_overview),
+                messages=request_messages,
+            ) as stream:
+                async for text in stream.text_stream:
+                    released = guard.feed(text)
+                    if released:
+                        emitted += released
+                        yield released
+                    if guard.match is not None:
+                        break
+                else:
+                    self._record_usage(span.call_type, (await stream.get_final_message()).usage)
+
+            if guard.match is None:
+                if tail := guard.flush():
+                    yield tail
+                return
+
+            logger.warning(
+                "forbidden_phrase quadrant=%s phrase=%s attempt=%d emitted_chars=%d",
+                quadrant_key, guard.match, attempt, len(emitted),
+            )
+            *history, last = messages
+            request_messages = history + [
+                {
+                    "role": "user",
+                    "content": last["content"] + "\n\n" + FORBIDDEN_PHRASE_REMINDER.format(phrase=guard.match),
+                },
+            ]
+            if emitted.strip():
+                request_messages.append({"role": "assistant", "content": emitted.rstrip()})
+            guard.reset()
+            span.retry("guard_regeneration")
+
+        # 上限まで生成し直しても禁止表現が出る場合は、その直前で応答を終える
+        span.fallback("guard_gave_up")
+        logger.warning("forbidden_phrase quadrant=%s gave_up emitted_chars=%d", quadrant_key, len(emitted))
+
+    async def check_quadrant_completion(
         self,
         quadrant_key: str,
         conversation: list[dict],
+        case_overview: str = "",
+        coverage: dict | None = None,
+        allow_precheck: bool = True,
     ) -> dict:
-        """象限の完了状態をチェック（JSON応答）"""
-        quad = next(q for q in QUADRANTS if q["key"] == quadrant_key)
+        """象限の完了状態をチェック（JSON応答）
 
-        history_text = "\n".join(
-            f"{'AI' if m['role'] == 'assistant' else 'ユーザー'}: {m['content']}"
-            for m in conversation
-        )
+        前回までの整理状況（coverage）と、まだ反映されていない新しいメッセージだけを
+        送る。戻り値は更新後の整理状況に is_complete を加えたもの。
+        ローカル判定で明らかに未完了なら API を呼ばずに返す。
+        """
+        if coverage is None:
+            coverage = new_coverage_state(quadrant_key)
+
+        if not pending_messages(coverage, conversation):
+            return {**coverage, "is_complete": False}
+
+        with call_span("completion_check") as span:
+            if allow_precheck and PRECHECK_ENABLED:
+                local = precheck(quadrant_key, coverage, conversation)
+                if local is not None:
+                    span.fallback("precheck_skip")
+                    if random.random() < PRECHECK_SHADOW_RATE:
+                        # 一致率の計測用。結果はログにのみ残す
+                        task = asyncio.create_task(
+                            self._shadow_check(quadrant_key, conversation, case_overview, coverage)
+                        )
+                        self._background_tasks.add(task)
+                        task.add_done_callback(self._background_tasks.discard)
+                    return local
+
+            return await self._check_with_llm(span, quadrant_key, conversation, case_overview, coverage)
+
+    async def _shadow_check(
+        self,
+        quadrant_key: str,
+        conversation: list[dict],
+        case_overview: str,
+        coverage: dict,
+    ) -> dict:
+        with call_span("completion_check_shadow") as span:
+            return await self._check_with_llm(
+                span, quadrant_key, conversation, case_overview, coverage, shadow=True
+            )
 
+    async def _check_with_llm(
+        self,
+        span: CallSpan,
+        quadrant_key: str,
+        conversation: list[dict],
+        case_overview: str,
+        coverage: dict,
+        shadow: bool = False,
+    ) -> dict:
+        quad = _find_quadrant(quadrant_key)
+        template_args = {
+            "quadrant_title": quad["title_ja"],
+            "subtopics_list": "、".join(quad["subtopics"]),
+            "previous_state": format_state(coverage),
+        }
+        # 反映待ちのメッセージが溜まっても入力トークンの上限を超えないよう、中ほどを省略する
+        reserved = estimate_request_tokens(_system_blocks(case_overview), [{
+            "role": "user",
+            "content": QUADRANT_COMPLETION_CHECK_PROMPT.format(new_exchange="", **template_args),
+        }])
         prompt = QUADRANT_COMPLETION_CHECK_PROMPT.format(
-            quadrant_title=quad["title_ja"],
-            subtopics_list="、".join(quad["subtopics"]),
-            conversation_history=history_text,
+            new_exchange=truncate_to_tokens(
+                format_exchange(pending_messages(coverage, conversation)),
+                COMPACTION_TOKEN_BUDGET - reserved,
+            ),
+            **template_args,
         )
 
-        response = self.client.messages.create(
-            model=MODEL,
-            max_tokens=1024,
-            temperature=0,
-            messages=[{"role": "user", "content": prompt}],
+        route = "completion_check"
+        request = {
+            **_route_params(route),
+            "system": _system_blocks(case_overview),
+            "messages": [{"role": "user", "content": prompt}],
+        }
+        cache_key = response_cache_key(
+            MODEL_ROUTES[route]["model"], QUADRANT_COMPLETION_CHECK_PROMPT, **request
         )
 
+        cached = self._cache_lookup(span.call_type, cache_key)
+        if cached is None:
+            response = await self._create(span, route, **request)
+            self._record_usage(span.call_type, response.usage)
+        parser = JSONStreamParser()
         try:
-            text = response.content[0].text.strip()
-            if text.startswith("```"):
-                text = text.split("\n", 1)[1].rsplit("```", 1)[0].strip()
-            return json.loads(text)
-        except (json.JSONDecodeError, IndexError):
-            return {
-                "is_complete": False,
-                "covered_subtopics": [],
-                "remaining_subtopics": quad["subtopics"],
-                "summary": "",
-            }
+            parser.feed(cached if cached is not None else _response_text(response))
+            result = await self._complete_json(
+                span, case_overview, prompt, route, parser, COMPLETION_CHECK_SCHEMA
+            )
+        except JSONExtractError:
+            # 反映済み位置を進めず、次回のチェックで同じメッセージを再送する
+            span.fallback("unchanged_coverage")
+            return {**coverage, "is_complete": False}
+        if cached is None:
+            self._cache_store(cache_key, result)
+        completion = {
+            "is_complete": bool(result.get("is_complete", False)),
+            **updated_state(coverage, result, len(conversation)),
+        }
+        logger.info(
+            "completion_check quadrant=%s turn=%d is_complete=%s remaining=%s shadow=%s",
+            quadrant_key, len(conversation), completion["is_complete"],
+            completion["remaining_subtopics"], shadow,
+        )
+        return completion
 
-    def synthesize_table(
+    async def synthesize_table(
         self,
         case_overview: str,
         quadrant_summaries: dict[str, str],
     ) -> dict:
         """4象限を統合して構造化テーブルを生成"""
+        table_data = None
+        async for event in self.synthesize_table_stream(case_overview, quadrant_summaries):
+            if event["type"] == "done":
+                table_data = event["table_data"]
+        return table_data
+
+    async def synthesize_table_stream(
+        self,
+        case_overview: str,
+        quadrant_summaries: dict[str, str],
+        reuse: dict[str, dict] | None = None,
+    ) -> AsyncIterator[dict]:
+        """4象限の統合をストリーミングで生成し、確定した項目から順にイベントとして返す
+
+        イベントは {"type": "entry", "quadrant", "subtopic", "text"}、
+        {"type": "discussion_point", "text"}、{"type": "tension", "text"} で、
+        最後に {"type": "done", "table_data"} が統合結果全体を返す。
+        reuse（象限キー → 構造化済みの表）に含まれる象限は作り直さない（並列統合のときのみ）。
+        """
+        with call_span("synthesis") as span:
+            async for event in self._synthesis_stream(span, case_overview, quadrant_summaries, reuse or {}):
+                span.first_token()
+                yield event
+
+    async def _synthesis_stream(
+        self,
+        span: CallSpan,
+        case_overview: str,
+        quadrant_summaries: dict[str, str],
+        reuse: dict[str, dict],
+    ) -> AsyncIterator[dict]:
+        # 並列の呼び出しから届く項目を、届いた順にイベントとして返す
+        events: asyncio.Queue = asyncio.Queue()
+        build = self._fan_out_synthesis if SYNTHESIS_FAN_OUT else self._single_synthesis
+
+        async def run():
+            try:
+                table_data = await build(
+                    span, case_overview, quadrant_summaries, reuse, events.put_nowait
+                )
+            except Exception as e:
+                events.put_nowait(e)
+            else:
+                events.put_nowait({"type": "done", "table_data": table_data})
+
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                event = await events.get()
+                if isinstance(event, Exception):
+                    raise event
+                yield event
+                if event["type"] == "done":
+                    return
+        finally:
+            task.cancel()
+
+    async def _json_call(
+        self,
+        span: CallSpan,
+        case_overview: str,
+        template: str,
+        prompt: str,
+        route: str,
+        schema: dict,
+        on_value,
+    ) -> dict:
+        """JSON応答をストリーミングで取得し、確定した値ごとに on_value(path, value) を呼ぶ
+
+        応答キャッシュを使い、途中で切れた・欠けた部分は _complete_json で補う。
+        取り出せない場合は JSONExtractError を送出する（それまでに確定した値は on_value 済み）。
+        """
+        request = {
+            **_route_params(route),
+            "system": _system_blocks(case_overview),
+            "messages": [{"role": "user", "content": prompt}],
+        }
+        cache_key = response_cache_key(MODEL_ROUTES[route]["model"], template, **request)
+
+        parser = JSONStreamParser()
+        cached = self._cache_lookup(span.call_type, cache_key)
+        try:
+            if cached is not None:
+                for path, value in parser.feed(cached):
+                    on_value(path, value)
+            else:
+                async with self._stream(span, route, **request) as stream:
+                    async for text in stream.text_stream:
+                        for path, value in parser.feed(text):
+                            on_value(path, value)
+                    self._record_usage(span.call_type, (await stream.get_final_message()).usage)
+        except JSONExtractError:
+            PARSE_FAILURES.inc(call_type=span.call_type)
+            raise
+
+        result = await self._complete_json(span, case_overview, prompt, route, parser, schema)
+        if cached is None:
+            self._cache_store(cache_key, result)
+        return result
+
+    async def _single_synthesis(
+        self,
+        span: CallSpan,
+        case_overview: str,
+        quadrant_summaries: dict[str, str],
+        reuse: dict[str, dict],
+        emit,
+    ) -> dict:
+        """1回の呼び出しで表・検討ポイント・緊張関係をまとめて生成（reuse は使わない）
+
+        応答を解釈できなければ、それまでに届いた項目から表を組み立てる。
+        """
         prompt = SYNTHESIS_PROMPT.format(
-            case_overview=case_overview,
             medical_indications_summary=quadrant_summaries.get("medical_indications", "（未整理）"),
             patient_preferences_summary=quadrant_summaries.get("patient_preferences", "（未整理）"),
             qol_summary=quadrant_summaries.get("qol", "（未整理）"),
             contextual_features_summary=quadrant_summaries.get("contextual_features", "（未整理）"),
         )
 
-        response = self.client.messages.create(
-            model=MODEL,
-            max_tokens=4096,
-            temperature=0,
-            system=SYSTEM_PROMPT,
-            messages=[{"role": "user", "content": prompt}],
+        events = []
+
+        def on_value(path, value):
+            event = _synthesis_event(path, value)
+            if event is not None:
+                events.append(event)
+                emit(event)
+
+        try:
+            return await self._json_call(
+                span, case_overview, SYNTHESIS_PROMPT, prompt,
+                "synthesis", SYNTHESIS_SCHEMA, on_value,
+            )
+        except JSONExtractError:
+            if events:
+                span.fallback("partial_table")
+                return _table_from_events(events)
+            span.fallback("error_table")
+            return {"table": {}, "discussion_points": [SYNTHESIS_ERROR_POINT], "tensions": []}
+
+    async def _fan_out_synthesis(
+        self,
+        span: CallSpan,
+        case_overview: str,
+        quadrant_summaries: dict[str, str],
+        reuse: dict[str, dict],
+        emit,
+    ) -> dict:
+        """象限ごとの構造化を並列に行い、その結果から検討ポイントと緊張関係を生成
+
+        出力は呼び出しごとに逐次生成されるため、出力を分けるほど全体の所要時間が短くなる。
+        reuse にある象限（全サブトピックがそろっているもの）はそのまま使い、検討ポイントと
+        緊張関係だけを作り直す。応答を解釈できなかった象限は、それまでに届いた項目を使う。
+        結果は _single_synthesis と同じ形の table_data。
+        """
+        failed = []
+
+        async def structure(quad: dict) -> dict:
+            entries = {}
+
+            def on_value(path, value):
+                event = _synthesis_event(("table", quad["key"], *path), value)
+                if event is not None:
+                    entries[event["subtopic"]] = event["text"]
+                    emit(event)
+
+            previous = reuse.get(quad["key"]) or {}
+            if previous and all(s in previous for s in quad["subtopics"]):
+                for subtopic, text in previous.items():
+                    on_value((subtopic,), text)
+                return previous
+
+            template = json.dumps(
+                {s: "整理された内容" for s in quad["subtopics"]}, ensure_ascii=False, indent=2
+            )
+            prompt = QUADRANT_SYNTHESIS_PROMPT.format(
+                quadrant_title=quad["title_ja"],
+                summary=quadrant_summaries.get(quad["key"], "（未整理）"),
+                template=template,
+            )
+            try:
+                return await self._json_call(
+                    span, case_overview, QUADRANT_SYNTHESIS_PROMPT, prompt,
+                    "synthesis_quadrant", {s: str for s in quad["subtopics"]}, on_value,
+                )
+            except JSONExtractError:
+                span.fallback("error_quadrant")
+                failed.append(quad["key"])
+                return entries
+
+        tasks = [asyncio.create_task(structure(quad)) for quad in QUADRANTS]
+        try:
+            structured = await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        table = {quad["key"]: result for quad, result in zip(QUADRANTS, structured)}
+
+        def on_value(path, value):
+            event = _synthesis_event(path, value)
+            if event is not None:
+                emit(event)
+
+        sections = "\n\n".join(
+            f"【{quad['title_ja']}】\n"
+            + "\n".join(f"- {k}: {v}" for k, v in table[quad["key"]].items())
+            for quad in QUADRANTS
+        )
+        prompt = CROSS_QUADRANT_PROMPT.format(table=sections)
+        try:
+            cross = await self._json_call(
+                span, case_overview, CROSS_QUADRANT_PROMPT, prompt,
+                "synthesis_cross", CROSS_QUADRANT_SCHEMA, on_value,
+            )
+        except JSONExtractError:
+            span.fallback("error_cross")
+            cross = {"discussion_points": [], "tensions": []}
+
+        discussion_points = list(cross.get("discussion_points", []))
+        if failed:
+            discussion_points.append(SYNTHESIS_ERROR_POINT)
+        return {
+            "table": table,
+            "discussion_points": discussion_points,
+            "tensions": list(cross.get("tensions", [])),
+        }
+
+
+class EventLoopThread:
+    """専用スレッドでイベントループを回し、同期コードからコルーチンを実行する"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name="ethicsnavi-loop", daemon=True
         )
+        self._thread.start()
+
+    def submit(self, coro, cancel_token: CancelToken | None = None) -> Future:
+        """コルーチンをループに投入し concurrent.futures.Future を返す（待たない）
+
+        呼び出し元のコンテキスト（相関IDなど）はループ側のタスクに引き継がれる。
+        cancel_token が取り消されると、ループ側のタスクを中断する。
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        if cancel_token is not None:
+            cancel_token.register(future)
+        return future
 
+    def run(self, coro, cancel_token: CancelToken | None = None):
+        """コルーチンを実行して結果を待つ
+
+        cancel_token が取り消されると、ループ側のタスクを中断して CancelledError を送出する。
+        """
+        return self.submit(coro, cancel_token).result()
+
+    def iterate(self, agen: AsyncIterator, cancel_token: CancelToken | None = None) -> Iterator:
+        """非同期ジェネレータを同期ジェネレータとして取り出す。close() で非同期側も閉じる"""
+        cancelled = False
         try:
-            text = response.content[0].text.strip()
-            if text.startswith("```"):
-                text = text.split("\n", 1)[1].rsplit("```", 1)[0].strip()
-            return json.loads(text)
-        except (json.JSONDecodeError, IndexError):
-            return {
-                "table": {},
-                "discussion_points": ["データの解析に失敗しました。再度お試しください。"],
-                "tensions": [],
-            }
+            while True:
+                try:
+                    yield self.run(agen.__anext__(), cancel_token)
+                except StopAsyncIteration:
+                    return
+        except CancelledError:
+            # 中断されたタスクの中で非同期ジェネレータ（とストリーム）が閉じられる
+            cancelled = True
+            raise
+        finally:
+            if not cancelled:
+                self.run(agen.aclose())
+
+
+_loop_thread: EventLoopThread | None = None
+_loop_thread_lock = threading.Lock()
+
+
+def get_loop_thread() -> EventLoopThread:
+    """プロセス共有のイベントループスレッドを取得"""
+    global _loop_thread
+    with _loop_thread_lock:
+        if _loop_thread is None:
+            _loop_thread = EventLoopThread()
+        return _loop_thread
+
+
+class EthicsNaviClient:
+    """AsyncEthicsNaviClient の同期ブリッジ。Streamlit のスクリプトスレッドから利用する
+
+    各メソッドの cancel_token を取り消すと、実行中の呼び出しを中断して HTTP 接続を解放する。
+    """
+
+    def __init__(self):
+        self.loop_thread = get_loop_thread()
+        self.async_client = AsyncEthicsNaviClient()
+
+    @property
+    def last_usage(self) -> dict[str, dict]:
+        return self.async_client.last_usage
+
+    @property
+    def usage_totals(self) -> dict[str, int]:
+        return self.async_client.usage_totals
+
+    def response_cache_stats(self) -> dict[str, dict]:
+        """呼び出し種別ごとの応答キャッシュのヒット率"""
+        return self.async_client.response_cache_stats()
+
+    def ask_quadrant_questions_stream(
+        self,
+        case_overview: str,
+        quadrant_key: str,
+        conversation: list[dict],
+        remaining_subtopics: list[str] | None = None,
+        coverage: dict | None = None,
+        cancel_token: CancelToken | None = None,
+    ) -> Iterator[str]:
+        """象限の深掘り質問をストリーミングで生成"""
+        return self.loop_thread.iterate(
+            self.async_client.ask_quadrant_questions_stream(
+                case_overview=case_overview,
+                quadrant_key=quadrant_key,
+                conversation=list(conversation),
+                remaining_subtopics=remaining_subtopics,
+                coverage=coverage,
+            ),
+            cancel_token,
+        )
+
+    def prefetch_opening_question(
+        self,
+        case_overview: str,
+        quadrant_key: str,
+        cancel_token: CancelToken | None = None,
+    ) -> Future:
+        """象限の最初の質問の生成を裏で始め、結果の Future を返す（先行生成用）
+
+        スレッドを使わずイベントループで直接実行する。
+        """
+        return self.loop_thread.submit(
+            self.async_client.prefetch_opening_question(
+                case_overview=case_overview,
+                quadrant_key=quadrant_key,
+            ),
+            cancel_token,
+        )
+
+    def check_quadrant_completion(
+        self,
+        quadrant_key: str,
+        conversation: list[dict],
+        case_overview: str = "",
+        coverage: dict | None = None,
+        allow_precheck: bool = True,
+        cancel_token: CancelToken | None = None,
+    ) -> dict:
+        """象限の完了状態をチェック（JSON応答）"""
+        return self.loop_thread.run(
+            self.async_client.check_quadrant_completion(
+                quadrant_key=quadrant_key,
+                conversation=list(conversation),
+                case_overview=case_overview,
+                coverage=coverage,
+                allow_precheck=allow_precheck,
+            ),
+            cancel_token,
+        )
+
+    def submit_completion_check(
+        self,
+        quadrant_key: str,
+        conversation: list[dict],
+        case_overview: str = "",
+        coverage: dict | None = None,
+        cancel_token: CancelToken | None = None,
+    ) -> Future:
+        """完了チェックを裏で始め、結果の Future を返す（次の質問の生成と並行させる用）"""
+        return self.loop_thread.submit(
+            self.async_client.check_quadrant_completion(
+                quadrant_key=quadrant_key,
+                conversation=list(conversation),
+                case_overview=case_overview,
+                coverage=coverage,
+            ),
+            cancel_token,
+        )
+
+    def synthesize_table(
+        self,
+        case_overview: str,
+        quadrant_summaries: dict[str, str],
+        cancel_token: CancelToken | None = None,
+    ) -> dict:
+        """4象限を統合して構造化テーブルを生成"""
+        return self.loop_thread.run(
+            self.async_client.synthesize_table(
+                case_overview=case_overview,
+                quadrant_summaries=quadrant_summaries,
+            ),
+            cancel_token,
+        )
+
+    def synthesize_table_stream(
+        self,
+        case_overview: str,
+        quadrant_summaries: dict[str, str],
+        reuse: dict[str, dict] | None = None,
+        cancel_token: CancelToken | None = None,
+    ) -> Iterator[dict]:
+        """4象限の統合をストリーミングで生成（確定した項目から順にイベントを返す）"""
+        return self.loop_thread.iterate(
+            self.async_client.synthesize_table_stream(
+                case_overview=case_overview,
+                quadrant_summaries=quadrant_summaries,
+                reuse=reuse,
+            ),
+            cancel_token,
+        )
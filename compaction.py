@@ -0,0 +1,64 @@
+"""長い象限対話の圧縮（古いターンを整理状況の要約に置き換えてトークン数を抑える）"""
+
+from config import (
+    COMPACTION_KEEP_MESSAGES,
+    COMPACTION_TRIGGER_TOKENS,
+    COMPACTION_TOKEN_BUDGET,
+)
+from prompts import COMPACTED_HISTORY_PROMPT
+from tokens import estimate_request_tokens, estimate_tokens, truncate_to_tokens
+
+# 省略してもこれ以上は短くしないメッセージの長さ（トークン）
+_MIN_MESSAGE_TOKENS = 50
+
+
+def history_summary_message(coverage: dict) -> dict:
+    """完了チェックが積み上げた整理状況を、古いターンの代わりに置くメッセージにする"""
+    notes = "\n".join(f"- {k}: {v}" for k, v in coverage["partial_notes"].items()) or "（なし）"
+    return {
+        "role": "user",
+        "content": COMPACTED_HISTORY_PROMPT.format(
+            summary=coverage["summary"] or "（なし）",
+            covered_subtopics="、".join(coverage["covered_subtopics"]) or "（なし）",
+            partial_notes=notes,
+        ),
+    }
+
+
+def compact_conversation(
+    conversation: list[dict],
+    coverage: dict | None,
+    reserved_tokens: int,
+) -> list[dict]:
+    """リクエストの見積もりが上限に収まるよう会話を圧縮したコピーを返す
+
+    reserved_tokens は system と追加の指示文の分。見積もりが COMPACTION_TRIGGER_TOKENS 以下なら
+    会話をそのまま返す（プロンプトキャッシュを活かすため）。超えた場合は、完了チェックで
+    整理状況に反映済みのターンのうち直近 COMPACTION_KEEP_MESSAGES 件より古いものを要約に置き換え、
+    それでも COMPACTION_TOKEN_BUDGET を超えるなら反映済みのターンをさらに要約に回し、
+    最後に古いメッセージから順に中ほどを省略する。
+    """
+    def size(messages: list[dict]) -> int:
+        return reserved_tokens + estimate_request_tokens("", messages)
+
+    if size(conversation) <= COMPACTION_TRIGGER_TOKENS:
+        return conversation
+
+    checked = coverage["checked_turns"] if coverage else 0
+    # 最新のメッセージは必ずそのまま残す
+    max_cut = min(checked, len(conversation) - 1)
+    cut = min(max(0, len(conversation) - COMPACTION_KEEP_MESSAGES), max_cut)
+    while True:
+        messages = ([history_summary_message(coverage)] if cut else []) + list(conversation[cut:])
+        if size(messages) <= COMPACTION_TOKEN_BUDGET or cut >= max_cut:
+            break
+        cut += 1
+
+    index = 1 if cut else 0
+    while size(messages) > COMPACTION_TOKEN_BUDGET and index < len(messages):
+        excess = size(messages) - COMPACTION_TOKEN_BUDGET
+        content = messages[index]["content"]
+        target = max(_MIN_MESSAGE_TOKENS, estimate_tokens(content) - excess)
+        messages[index] = {**messages[index], "content": truncate_to_tokens(content, target)}
+        index += 1
+    return messages
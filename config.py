@@ -47,10 +47,149 @@ QUADRANTS = [
     },
 ]
 
+# 完了チェック前のローカル判定に使うサブトピックごとの語彙（サブトピック名自体も含めて索引化する）
+SUBTOPIC_KEYWORDS = {
+    "診断と予後": ["診断", "予後", "病名", "病期", "ステージ", "余命", "進行", "転移", "見通し"],
+    "治療の目標": ["目標", "ゴール", "目的", "延命", "根治", "緩和", "症状コントロール"],
+    "治療の選択肢": ["選択肢", "治療法", "手術", "化学療法", "抗がん剤", "放射線", "透析", "人工呼吸", "胃ろう", "代替"],
+    "医学的無益性": ["無益", "効果が乏しい", "効果が期待", "見込みがない", "益がない", "負担が大きい", "過剰"],
+    "患者の希望": ["希望", "意向", "望んで", "望まない", "本人の思い", "意思", "価値観", "リビングウィル", "事前指示"],
+    "インフォームドコンセント": ["説明", "同意", "インフォームド", "IC", "理解", "告知", "納得"],
+    "判断能力": ["判断能力", "意思決定能力", "認知症", "認知機能", "せん妄", "意識", "理解力", "能力"],
+    "代理決定者": ["代理", "キーパーソン", "後見", "家族が決め", "推定意思", "代諾"],
+    "治療後のQOL見込み": ["QOL", "生活の質", "治療後", "回復", "後遺症", "機能", "寝たきり"],
+    "日常生活への影響": ["日常生活", "ADL", "生活", "仕事", "食事", "歩行", "介護", "自宅"],
+    "QOL評価の主体": ["評価", "誰が", "本人にとって", "本人の視点", "主観", "満足"],
+    "偏見の排除": ["偏見", "先入観", "年齢", "高齢だから", "障害", "差別", "思い込み"],
+    "家族の意向": ["家族", "息子", "娘", "妻", "夫", "配偶者", "親族", "兄弟"],
+    "経済的問題": ["経済", "費用", "医療費", "お金", "保険", "収入", "負担額"],
+    "法的問題": ["法的", "法律", "訴訟", "ガイドライン", "警察", "同意書", "成年後見"],
+    "施設の方針": ["施設", "病院の方針", "方針", "倫理委員会", "転院", "病床", "体制", "マンパワー"],
+}
+
+# ローカル判定: 未言及のサブトピックがこの数以上残っていれば LLM チェックを省略する
+PRECHECK_ENABLED = True
+PRECHECK_MIN_UNTOUCHED = 2
+# これより長い回答は暗黙的に複数のサブトピックに触れうるため、必ず LLM で判定する
+PRECHECK_MAX_CHARS = 400
+# 省略したターンのうち、一致率の計測用に裏で LLM チェックも実行する割合
+PRECHECK_SHADOW_RATE = 0.1
+
 MODEL = "claude-sonnet-4-20250514"
 MAX_TOKENS = 2048
 TEMPERATURE = 0.7
 
+# 完了チェックのような判定だけの呼び出しに使う高速なモデル
+FAST_MODEL = "claude-3-5-haiku-20241022"
+
+# 呼び出しの種類（ルート）ごとのモデル・出力トークン上限・temperature・タイムアウト（秒）
+# ルートはメトリクスとログに記録され、ルート間で所要時間と結果を比較できる
+MODEL_ROUTES = {
+    "opening_question": {
+        "model": MODEL, "max_tokens": MAX_TOKENS, "temperature": TEMPERATURE, "timeout": 60.0,
+    },
+    "followup_question": {
+        "model": MODEL, "max_tokens": MAX_TOKENS, "temperature": TEMPERATURE, "timeout": 60.0,
+    },
+    "completion_check": {
+        "model": FAST_MODEL, "max_tokens": 1024, "temperature": 0, "timeout": 30.0,
+    },
+    # 1回の呼び出しで統合する場合（SYNTHESIS_FAN_OUT = False）
+    "synthesis": {
+        "model": MODEL, "max_tokens": 4096, "temperature": 0, "timeout": 180.0,
+    },
+    # 並列統合の象限ごとの構造化と、検討ポイント・緊張関係の生成
+    "synthesis_quadrant": {
+        "model": MODEL, "max_tokens": 1024, "temperature": 0, "timeout": 90.0,
+    },
+    "synthesis_cross": {
+        "model": MODEL, "max_tokens": 1024, "temperature": 0, "timeout": 90.0,
+    },
+}
+
+# Anthropic API への共有HTTP接続プール（全セッションで1つを使い回す）
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 50
+HTTP_KEEPALIVE_EXPIRY = 60.0
+HTTP_CONNECT_TIMEOUT = 5.0
+HTTP_READ_TIMEOUT = 600.0
+
+# 全セッション共有の呼び出しスケジューラ: 1分あたりの上限（応答ヘッダで補正される）と再試行
+SCHEDULER_REQUESTS_PER_MINUTE = 50
+SCHEDULER_INPUT_TOKENS_PER_MINUTE = 40000
+SCHEDULER_OUTPUT_TOKENS_PER_MINUTE = 8000
+SCHEDULER_MAX_RETRIES = 4
+SCHEDULER_BACKOFF_BASE = 1.0
+SCHEDULER_BACKOFF_MAX = 30.0
+# 呼び出し種別ごとの優先度（小さいほど先に通す）。対話中のストリームを裏の処理より優先する
+SCHEDULER_PRIORITIES = {
+    "question": 0,
+    "completion_check": 0,
+    "synthesis": 1,
+    "opening_prefetch": 2,
+    "completion_check_shadow": 3,
+}
+
+# 会話の圧縮: 見積もりが TRIGGER を超えたら、直近 KEEP 件より古い反映済みのターンを要約に置き換える。
+# BUDGET は1回の呼び出しの入力トークンの上限（tokens.py のローカル見積もり）
+COMPACTION_KEEP_MESSAGES = 6
+COMPACTION_TRIGGER_TOKENS = 6000
+COMPACTION_TOKEN_BUDGET = 12000
+
+# 完了チェックと次の質問生成を並行して走らせる（完了判定ならストリームを打ち切る）
+SPECULATIVE_TURNS = True
+
+# 統合を象限ごとの並列呼び出しと、検討ポイント・緊張関係をまとめる小さな呼び出しに分ける
+SYNTHESIS_FAN_OUT = True
+
+# ケース入力の直後に2象限目以降の最初の質問を並行して生成しておく
+PREFETCH_OPENING_QUESTIONS = True
+
+# 質問のストリームの細かいチャンクをまとめて画面に送る（待ち時間の上限と文字数の上限）
+STREAM_COALESCE_MS = 60
+STREAM_COALESCE_MAX_CHARS = 80
+
+# 質問のストリーム中に禁止表現を検出したら、その直前から生成し直す（上限回数）
+FORBIDDEN_PHRASE_GUARD = True
+GUARD_MAX_REGENERATIONS = 2
+
+# JSON応答が途中で切れた・フィールドが欠けた場合、足りない部分だけを再リクエストする
+JSON_REPAIR_RETRY = True
+
+# temperature=0 の呼び出し（完了チェック・統合）の応答をディスクにキャッシュする（既定は無効）
+RESPONSE_CACHE_ENABLED = False
+RESPONSE_CACHE_PATH = ".cache/responses.sqlite3"
+RESPONSE_CACHE_MAX_BYTES = 50 * 1024 * 1024
+RESPONSE_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# 統合まで終えたケースをローカルに保存し、検索して開き直せるようにする
+# アプリの利用者全員が全ケースを検索・閲覧できるため、既定では無効（有効にすると入力画面で告知する）
+CASE_ARCHIVE_ENABLED = False
+CASE_ARCHIVE_PATH = ".cache/cases.sqlite3"
+CASE_ARCHIVE_PAGE_SIZE = 10
+
+# セッション状態をプロセスの外に保存し、複数プロセスでの運用や再起動後の再開を可能にする
+# （"sqlite" または None。None なら Streamlit のプロセス内の状態だけを使う）
+# 対話の内容をディスクに残し、URL の sid を知っていれば誰でも再開できるため、既定では無効
+SESSION_STORE_BACKEND = None
+SESSION_STORE_PATH = ".cache/sessions.sqlite3"
+SESSION_STORE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# PDF生成: 解析済みフォントをプロセス内でキャッシュする
+PDF_FONT_CACHE = True
+# 生成済みPDFのキャッシュ上限（全セッション合計）
+PDF_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Prometheus 形式のメトリクス（/metrics, /metrics.json）を公開するポート。None で無効
+# 認証がないため、既定ではローカルからのみ受け付ける（外部から収集する場合は METRICS_HOST を変える）
+METRICS_PORT = None
+METRICS_HOST = "127.0.0.1"
+
+# バッチモード（batch.py）: 同時に処理するケース数、API呼び出しの上限、PDF生成プロセス数
+BATCH_CONCURRENCY = 8
+BATCH_REQUESTS_PER_MINUTE = 50
+BATCH_PDF_WORKERS = 4
+
 DISCLAIMER = "本ツールは意思決定支援であり、最終判断は医療チームに委ねられます。"
 
 PRIVACY_NOTICE = (
@@ -58,3 +197,16 @@ PRIVACY_NOTICE = (
     "患者氏名・ID・生年月日など個人を特定できる情報は入力しないでください。"
     "「80代男性」「進行性肺癌」のように匿名化した記述をお願いします。"
 )
+
+# セッション保存先を有効にしたときに PRIVACY_NOTICE に続けて表示する
+SESSION_STORE_NOTICE = (
+    "途中から再開できるよう、対話の内容はこのサーバーのディスクに最長"
+    f"{SESSION_STORE_TTL_SECONDS // (24 * 60 * 60)}日間保存されます。"
+    "このページのURLを知っている人は誰でも続きを開けるため、URLを共有しないでください。"
+)
+
+# ケースアーカイブを有効にしたときに PRIVACY_NOTICE に続けて表示する
+CASE_ARCHIVE_NOTICE = (
+    "統合まで終えたケースは、このサーバーのディスクに保存されます。"
+    "保存したケースは、このアプリの他の利用者も検索して開くことができます。"
+)
@@ -0,0 +1,134 @@
+"""象限ごとのサブトピック整理状況（完了チェックの差分入力用）"""
+
+import json
+import logging
+
+from config import (
+    QUADRANTS,
+    SUBTOPIC_KEYWORDS,
+    PRECHECK_MIN_UNTOUCHED,
+    PRECHECK_MAX_CHARS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _build_keyword_index() -> dict[str, tuple[str, ...]]:
+    """サブトピック名 → 照合語のタプル（サブトピック名自体を含む）"""
+    index = {}
+    for quad in QUADRANTS:
+        for subtopic in quad["subtopics"]:
+            terms = {subtopic, *SUBTOPIC_KEYWORDS.get(subtopic, [])}
+            index[subtopic] = tuple(sorted(t.lower() for t in terms))
+    return index
+
+
+KEYWORD_INDEX = _build_keyword_index()
+
+
+def new_coverage_state(quadrant_key: str) -> dict:
+    """未チェックの象限の整理状況を作成"""
+    quad = next(q for q in QUADRANTS if q["key"] == quadrant_key)
+    return {
+        "covered_subtopics": [],
+        "remaining_subtopics": list(quad["subtopics"]),
+        "partial_notes": {},
+        "summary": "",
+        # 状態に反映済みの会話メッセージ数
+        "checked_turns": 0,
+    }
+
+
+def pending_messages(state: dict, conversation: list[dict]) -> list[dict]:
+    """まだ状態に反映されていないメッセージを取得"""
+    return conversation[state["checked_turns"]:]
+
+
+def format_state(state: dict) -> str:
+    """完了チェックに渡す整理状況のテキスト"""
+    return json.dumps(
+        {
+            "covered_subtopics": state["covered_subtopics"],
+            "remaining_subtopics": state["remaining_subtopics"],
+            "partial_notes": state["partial_notes"],
+            "summary": state["summary"],
+        },
+        ensure_ascii=False,
+        indent=2,
+    )
+
+
+def format_exchange(messages: list[dict]) -> str:
+    """対話メッセージを完了チェック用のテキストに整形"""
+    return "\n".join(
+        f"{'AI' if m['role'] == 'assistant' else 'ユーザー'}: {m['content']}"
+        for m in messages
+    )
+
+
+# 整理状況のフィールドの型（応答の値が合わなければ前回の値を使う）
+_FIELD_TYPES = {
+    "covered_subtopics": list,
+    "remaining_subtopics": list,
+    "partial_notes": dict,
+    "summary": str,
+}
+
+
+def _valid_field(value, expected: type) -> bool:
+    if not isinstance(value, expected):
+        return False
+    if expected is list:
+        return all(isinstance(v, str) for v in value)
+    if expected is dict:
+        return all(isinstance(k, str) for k in value)
+    return True
+
+
+def updated_state(previous: dict, result: dict, checked_turns: int) -> dict:
+    """完了チェックの応答から新しい整理状況を作成
+
+    欠けているフィールドや型の合わない値（null など）は前回の値のままにする。
+    """
+    state = {}
+    for name, expected in _FIELD_TYPES.items():
+        value = result.get(name)
+        if _valid_field(value, expected):
+            state[name] = value
+        else:
+            if name in result:
+                logger.warning("coverage_field_invalid field=%s type=%s", name, type(value).__name__)
+            state[name] = previous[name]
+    state["checked_turns"] = checked_turns
+    return state
+
+
+def touched_subtopics(text: str, subtopics: list[str]) -> list[str]:
+    """テキストが言及していると推定されるサブトピック"""
+    text = text.lower()
+    return [s for s in subtopics if any(t in text for t in KEYWORD_INDEX.get(s, (s,)))]
+
+
+def precheck(quadrant_key: str, state: dict, conversation: list[dict]) -> dict | None:
+    """LLM を呼ばずに「明らかに未完了」と判定できれば完了チェック結果を返す
+
+    判定できない場合は None を返し、呼び出し側で LLM による完了チェックを行う。
+    省略したメッセージは checked_turns を進めないため、次回の LLM チェックでまとめて反映される。
+    """
+    answer = "\n".join(
+        m["content"] for m in pending_messages(state, conversation) if m["role"] == "user"
+    )
+    remaining = state["remaining_subtopics"]
+    touched = touched_subtopics(answer, remaining)
+    untouched = [s for s in remaining if s not in touched]
+    skip = len(answer) <= PRECHECK_MAX_CHARS and len(untouched) >= PRECHECK_MIN_UNTOUCHED
+
+    logger.info(
+        "precheck quadrant=%s turn=%d decision=%s chars=%d touched=%s untouched=%s",
+        quadrant_key, len(conversation), "skip" if skip else "llm",
+        len(answer), touched, untouched,
+    )
+    if not skip:
+        return None
+    # 未言及のサブトピックを優先して次の質問で扱う
+    return {**state, "is_complete": False, "remaining_subtopics": untouched + touched}
@@ -0,0 +1,204 @@
+"""LLM応答からのJSON抽出（ストリーム対応）"""
+
+import json
+import re
+
+_WHITESPACE = " \t\r\n"
+_CLOSERS = {"obj": "}", "arr": "]"}
+# 途中で切れた \uXXXX エスケープ
+_PARTIAL_ESCAPE = re.compile(r"\\(u[0-9a-fA-F]{0,3})?$")
+
+
+class JSONExtractError(ValueError):
+    """応答テキストからJSONオブジェクトを取り出せない"""
+
+
+def _decode(token: str):
+    """確定した文字列・リテラルを値にする（文字列中の改行などの制御文字は許す）"""
+    try:
+        return json.loads(token, strict=False)
+    except json.JSONDecodeError as e:
+        raise JSONExtractError(f"JSONの値を解釈できません: {token[:40]!r}") from e
+
+
+class JSONStreamParser:
+    """テキストチャンクを受け取り、確定したJSONの値をその場で取り出すパーサ
+
+    最初の "{" より前のテキスト（コードフェンスや前置き）は読み飛ばし、
+    ルートのオブジェクトが閉じた後のテキストは無視する。
+    feed() は新たに確定した文字列・数値・真偽値・null を (パス, 値) の
+    リストで返す。パスはキーと配列の添字のタプル。
+    解釈できない値（不正なエスケープや引用符のない語）があれば JSONExtractError を送出する。
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.started = False
+        self.done = False
+        self.start = -1
+        self.end = -1
+        # 開いているコンテナごとに [種別("obj"|"arr"), 現在のキーまたは添字, キー待ちか]
+        self._stack: list[list] = []
+        self._pos = 0
+        self._in_string = False
+        self._escape = False
+        self._string_is_key = False
+        self._token: list[str] = []
+        self._literal: list[str] = []
+        # 括弧を閉じれば有効なJSONになる直近の位置と、そのときの閉じ括弧
+        self._safe_end = -1
+        self._safe_closers = ""
+
+    @property
+    def path(self) -> tuple:
+        """現在位置のパス"""
+        return tuple(frame[1] for frame in self._stack)
+
+    @property
+    def truncated(self) -> bool:
+        """ルートのオブジェクトが開いたまま終わっているか"""
+        return self.started and not self.done
+
+    def feed(self, chunk: str) -> list[tuple[tuple, object]]:
+        """チャンクを読み進め、このチャンクで確定した値を返す"""
+        self.text += chunk
+        values = []
+        for c in chunk:
+            if self.done:
+                break
+            self._step(c, values)
+            self._pos += 1
+        return values
+
+    def result(self) -> dict:
+        """ここまでのテキストからJSONオブジェクトを取り出す
+
+        途中で切れている場合は、書きかけの文字列を閉じ、閉じていない括弧を補う。
+        書きかけのキーや数値など補えない部分は捨てる。
+        """
+        if not self.started:
+            raise JSONExtractError("応答にJSONオブジェクトが含まれていません")
+        if self.done:
+            return json.loads(self.text[self.start:self.end], strict=False)
+
+        closers = self._closers()
+        if self._in_string and not self._string_is_key:
+            partial = _PARTIAL_ESCAPE.sub("", self.text[self.start:self._pos])
+            try:
+                return json.loads(partial + '"' + closers, strict=False)
+            except json.JSONDecodeError:
+                pass
+        if self._literal:
+            try:
+                json.loads("".join(self._literal))
+                return json.loads(self.text[self.start:self._pos] + closers, strict=False)
+            except json.JSONDecodeError:
+                pass
+        return json.loads(self.text[self.start:self._safe_end] + self._safe_closers, strict=False)
+
+    def _closers(self) -> str:
+        return "".join(_CLOSERS[frame[0]] for frame in reversed(self._stack))
+
+    def _mark_safe(self, end: int):
+        self._safe_end = end
+        self._safe_closers = self._closers()
+
+    def _step(self, c: str, values: list):
+        if not self.started:
+            if c == "{":
+                self.started = True
+                self.start = self._pos
+                self._stack.append(["obj", None, True])
+                self._mark_safe(self._pos + 1)
+            return
+
+        if self._in_string:
+            self._token.append(c)
+            if self._escape:
+                self._escape = False
+            elif c == "\\":
+                self._escape = True
+            elif c == '"':
+                self._in_string = False
+                value = _decode("".join(self._token))
+                if self._string_is_key:
+                    self._stack[-1][1] = value
+                else:
+                    values.append((self.path, value))
+                    self._mark_safe(self._pos + 1)
+            return
+
+        if self._literal:
+            if c not in _WHITESPACE and c not in ",}]":
+                self._literal.append(c)
+                return
+            values.append((self.path, _decode("".join(self._literal))))
+            self._literal = []
+            self._mark_safe(self._pos)
+
+        if c in _WHITESPACE:
+            return
+        frame = self._stack[-1]
+        if c == '"':
+            self._in_string = True
+            self._string_is_key = frame[0] == "obj" and frame[2]
+            self._token = ['"']
+        elif c == "{":
+            self._stack.append(["obj", None, True])
+            self._mark_safe(self._pos + 1)
+        elif c == "[":
+            self._stack.append(["arr", 0, False])
+            self._mark_safe(self._pos + 1)
+        elif c in "}]":
+            self._stack.pop()
+            if not self._stack:
+                self.done = True
+                self.end = self._pos + 1
+            else:
+                self._mark_safe(self._pos + 1)
+        elif c == ":":
+            frame[2] = False
+        elif c == ",":
+            if frame[0] == "arr":
+                frame[1] += 1
+            else:
+                frame[2] = True
+        else:
+            self._literal.append(c)
+
+
+def extract_json(text: str) -> dict:
+    """任意のテキストからJSONオブジェクトを取り出す（途中で切れていれば補う）"""
+    parser = JSONStreamParser()
+    parser.feed(text)
+    return parser.result()
+
+
+def missing_fields(obj: dict, schema: dict, prefix: tuple = ()) -> list[tuple]:
+    """スキーマに対して欠けている・型の合わないフィールドのパスを返す
+
+    スキーマはキー → 型、または入れ子のスキーマ（dict）。
+    """
+    missing = []
+    for key, expected in schema.items():
+        path = prefix + (key,)
+        value = obj.get(key) if isinstance(obj, dict) else None
+        if isinstance(expected, dict):
+            if isinstance(value, dict):
+                missing.extend(missing_fields(value, expected, path))
+            else:
+                missing.append(path)
+        elif not isinstance(value, expected):
+            missing.append(path)
+    return missing
+
+
+def merge_json(base: dict, patch: dict) -> dict:
+    """patch の値で base を補った新しいオブジェクトを返す（入れ子のdictは再帰的に統合）"""
+    merged = dict(base)
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_json(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
@@ -1,25 +1,110 @@
 """fpdf2によるPDFレポート生成"""
 
+import copy
+import hashlib
+import json
+import logging
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+from contextvars import copy_context
 from datetime import datetime
-from fpdf import FPDF
+from io import BytesIO
 
-from config import DISCLAIMER
+from fontTools import ttLib
+from fpdf import FPDF, FPDF_VERSION
+from fpdf.fonts import TTFFont, SubsetMap
+
+from config import DISCLAIMER, PDF_FONT_CACHE, PDF_CACHE_MAX_BYTES
+from telemetry import PDF_CACHE, call_span
 
 FONT_DIR = os.path.join(os.path.dirname(__file__), "fonts")
 FONT_PATH = os.path.join(FONT_DIR, "NotoSansJP.ttf")
+FONT_FAMILY = "NotoSansJP"
+
+logger = logging.getLogger(__name__)
+
+# 解析済みフォントの使い回しは fpdf2 の TTFFont の内部属性を書き換えるため、
+# 動作を確認した版（requirements.txt の範囲）でだけ使い、それ以外は add_font で登録する
+_FONT_CACHE_FPDF_VERSIONS = ("2.8.",)
+_FONT_CACHE_SUPPORTED = FPDF_VERSION.startswith(_FONT_CACHE_FPDF_VERSIONS)
+if PDF_FONT_CACHE and not _FONT_CACHE_SUPPORTED:
+    logger.warning("pdf font cache disabled fpdf2=%s", FPDF_VERSION)
+
+# 出力時のサブセット化で使わないテーブル（fpdf2 も出力時に削除する）
+_PRUNED_TABLES = ("GDEF", "GPOS", "GSUB", "FFTM", "MATH", "hdmx", "meta", "BASE")
+
+_font_cache: tuple[bytes, TTFFont] | None = None
+_font_cache_lock = threading.Lock()
+
+
+def _load_pruned_font_bytes() -> bytes:
+    """埋め込みに不要なテーブルと重複した cmap サブテーブルを除いたフォントデータ
+
+    文書ごとのサブセット化では cmap の展開が支配的なので、
+    最も広い Unicode サブテーブル1つだけを残しておく。
+    """
+    ttfont = ttLib.TTFont(FONT_PATH, recalcTimestamp=False)
+    cmap = ttfont["cmap"]
+    unicode_tables = [t for t in cmap.tables if t.isUnicode() and t.format in (4, 12)]
+    if unicode_tables:
+        cmap.tables = [max(unicode_tables, key=lambda t: len(t.cmap))]
+    for tag in _PRUNED_TABLES:
+        if tag in ttfont:
+            del ttfont[tag]
+    output = BytesIO()
+    ttfont.save(output)
+    ttfont.close()
+    return output.getvalue()
+
+
+def _get_font_template() -> tuple[bytes, TTFFont]:
+    """フォントを1度だけ読み込み・解析して、プロセス内で使い回す
+
+    cmap・字幅・フォント記述子などの解析結果は全レポートで共有する。
+    """
+    global _font_cache
+    with _font_cache_lock:
+        if _font_cache is None:
+            pdf = FPDF()
+            pdf.add_font(FONT_FAMILY, "", FONT_PATH)
+            template = pdf.fonts[FONT_FAMILY.lower()]
+            template.ttfont.close()
+            _font_cache = (_load_pruned_font_bytes(), template)
+        return _font_cache
 
 
 class EthicsNaviPDF(FPDF):
     def __init__(self):
         super().__init__()
-        self.add_font("NotoSansJP", "", FONT_PATH, uni=True)
+        if PDF_FONT_CACHE and _FONT_CACHE_SUPPORTED:
+            self._add_cached_font()
+        else:
+            self.add_font(FONT_FAMILY, "", FONT_PATH, uni=True)
         self.set_auto_page_break(auto=True, margin=20)
 
+    def _add_cached_font(self):
+        """解析済みフォントを複製して登録する
+
+        出力時のサブセット化は ttfont を書き換えるため、ttfont だけは
+        メモリ上のフォントデータから文書ごとに開き直す（遅延読み込みなので安価）。
+        サブセットには、このレポートで使った字形だけが埋め込まれる。
+        """
+        font_bytes, template = _get_font_template()
+        font = copy.copy(template)
+        font.i = len(self.fonts) + 1
+        font.ttfont = ttLib.TTFont(BytesIO(font_bytes), recalcTimestamp=False, lazy=True)
+        font.missing_glyphs = []
+        font.biggest_size_pt = 0
+        font._hbfont = None
+        font.subset = SubsetMap(font)
+        self.fonts[font.fontkey] = font
+
     def header(self):
-        self.set_font("NotoSansJP", "", 16)
+        self.set_font(FONT_FAMILY, "", 16)
         self.cell(0, 10, "EthicsNavi 臨床倫理4分割表レポート", new_x="LMARGIN", new_y="NEXT", align="C")
-        self.set_font("NotoSansJP", "", 9)
+        self.set_font(FONT_FAMILY, "", 9)
         self.cell(
             0, 6,
             f"作成日: {datetime.now().strftime('%Y年%m月%d日')}",
@@ -29,12 +114,17 @@ class EthicsNaviPDF(FPDF):
 
     def footer(self):
         self.set_y(-15)
-        self.set_font("NotoSansJP", "", 7)
+        self.set_font(FONT_FAMILY, "", 7)
         self.cell(0, 10, DISCLAIMER, align="C")
 
 
 def generate_pdf(case_overview: str, table_data: dict) -> bytes:
     """4分割表のPDFレポートを生成"""
+    with call_span("pdf"):
+        return _render_report(case_overview, table_data)
+
+
+def _render_report(case_overview: str, table_data: dict) -> bytes:
     pdf = EthicsNaviPDF()
     pdf.add_page()
 
@@ -43,14 +133,14 @@ def generate_pdf(case_overview: str, table_data: dict) -> bytes:
     tensions = table_data.get("tensions", [])
 
     # --- ケース概要 ---
-    pdf.set_font("NotoSansJP", "", 13)
+    pdf.set_font(FONT_FAMILY, "", 13)
     pdf.cell(0, 8, "ケース概要", new_x="LMARGIN", new_y="NEXT")
-    pdf.set_font("NotoSansJP", "", 10)
+    pdf.set_font(FONT_FAMILY, "", 10)
     pdf.multi_cell(0, 6, case_overview)
     pdf.ln(6)
 
     # --- 4分割表 ---
-    pdf.set_font("NotoSansJP", "", 13)
+    pdf.set_font(FONT_FAMILY, "", 13)
     pdf.cell(0, 8, "Jonsenの臨床倫理4分割表", new_x="LMARGIN", new_y="NEXT")
     pdf.ln(2)
 
@@ -79,9 +169,9 @@ def generate_pdf(case_overview: str, table_data: dict) -> bytes:
 
     # --- 検討ポイント ---
     pdf.add_page()
-    pdf.set_font("NotoSansJP", "", 13)
+    pdf.set_font(FONT_FAMILY, "", 13)
     pdf.cell(0, 8, "検討すべきポイント", new_x="LMARGIN", new_y="NEXT")
-    pdf.set_font("NotoSansJP", "", 10)
+    pdf.set_font(FONT_FAMILY, "", 10)
     for i, point in enumerate(discussion_points, 1):
         pdf.multi_cell(0, 6, f"{i}. {point}")
         pdf.ln(2)
@@ -89,9 +179,9 @@ def generate_pdf(case_overview: str, table_data: dict) -> bytes:
     # --- 緊張関係 ---
     if tensions:
         pdf.ln(4)
-        pdf.set_font("NotoSansJP", "", 13)
+        pdf.set_font(FONT_FAMILY, "", 13)
         pdf.cell(0, 8, "象限間の緊張関係", new_x="LMARGIN", new_y="NEXT")
-        pdf.set_font("NotoSansJP", "", 10)
+        pdf.set_font(FONT_FAMILY, "", 10)
         for tension in tensions:
             pdf.multi_cell(0, 6, f"\u30fb{tension}")
             pdf.ln(2)
@@ -99,6 +189,85 @@ def generate_pdf(case_overview: str, table_data: dict) -> bytes:
     return bytes(pdf.output())
 
 
+def pdf_cache_key(case_overview: str, table_data: dict) -> str:
+    """PDFの内容を決める入力の安定したハッシュ"""
+    payload = json.dumps(
+        {"case_overview": case_overview, "table_data": table_data},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PDFCache:
+    """内容ハッシュをキーにした生成済みPDFのLRUキャッシュ（合計バイト数で上限を設ける）"""
+
+    def __init__(self, max_bytes: int = PDF_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._total_bytes = 0
+        self._pending: dict[str, Future] = {}
+        # 生成中に破棄されたキー（生成が終わってもキャッシュに入れない）
+        self._discarded: set[str] = set()
+        self._lock = threading.Lock()
+
+    def get(self, case_overview: str, table_data: dict) -> bytes:
+        """キャッシュ済みならそれを返し、なければ生成する。先行生成中なら完了を待つ"""
+        key = pdf_cache_key(case_overview, table_data)
+        with self._lock:
+            if key in self._entries:
+                PDF_CACHE.inc(result="hit")
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            pending = self._pending.get(key)
+            PDF_CACHE.inc(result="hit" if pending is not None else "miss")
+        if pending is not None:
+            return pending.result()
+        return self._build(key, case_overview, table_data)
+
+    def prebuild(self, executor: Executor, case_overview: str, table_data: dict) -> str:
+        """バックグラウンドでPDFを先行生成する。キーを返す"""
+        key = pdf_cache_key(case_overview, table_data)
+        with self._lock:
+            if key in self._entries or key in self._pending:
+                self._discarded.discard(key)
+                return key
+            self._pending[key] = executor.submit(
+                copy_context().run, self._build, key, case_overview, table_data
+            )
+        return key
+
+    def invalidate(self, key: str):
+        """キャッシュ済みのPDFを破棄（生成中なら、生成後にキャッシュに入れない）"""
+        with self._lock:
+            pdf_bytes = self._entries.pop(key, None)
+            if pdf_bytes is not None:
+                self._total_bytes -= len(pdf_bytes)
+            if key in self._pending:
+                self._discarded.add(key)
+
+    def _build(self, key: str, case_overview: str, table_data: dict) -> bytes:
+        try:
+            pdf_bytes = generate_pdf(case_overview, table_data)
+        except Exception:
+            with self._lock:
+                self._pending.pop(key, None)
+                self._discarded.discard(key)
+            raise
+        with self._lock:
+            self._pending.pop(key, None)
+            if key in self._discarded:
+                self._discarded.discard(key)
+                PDF_CACHE.inc(result="discarded")
+            elif key not in self._entries:
+                self._entries[key] = pdf_bytes
+                self._total_bytes += len(pdf_bytes)
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
+        return pdf_bytes
+
+
 def _render_row(pdf: FPDF, col_width: float, quadrants: list[tuple[str, dict]]):
     """2つの象限を横並びで描画"""
     x_start = pdf.l_margin
@@ -111,12 +280,12 @@ def _render_row(pdf: FPDF, col_width: float, quadrants: list[tuple[str, dict]]):
         pdf.set_xy(x, y_start)
 
         # タイトル
-        pdf.set_font("NotoSansJP", "", 11)
+        pdf.set_font(FONT_FAMILY, "", 11)
         pdf.set_fill_color(230, 240, 250)
         pdf.cell(col_width, 7, f" {title}", border=1, fill=True, new_x="LMARGIN", new_y="NEXT")
 
         # 内容
-        pdf.set_font("NotoSansJP", "", 9)
+        pdf.set_font(FONT_FAMILY, "", 9)
         content_start_y = pdf.get_y()
         for key, value in data.items():
             pdf.set_x(x)
@@ -0,0 +1,107 @@
+"""禁止表現の検出（Aho–Corasick 法による複数パターン照合）"""
+
+from collections import deque
+
+
+class PhraseMatcher:
+    """複数の語句を1回の走査で照合するオートマトン（構築時に一度だけ組み立てる）"""
+
+    def __init__(self, patterns: list[str]):
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail = [0]
+        self._depth = [0]
+        # 状態で終わる最長の語句（失敗遷移先の語句も引き継ぐ）
+        self._output: list[str | None] = [None]
+
+        for pattern in patterns:
+            state = 0
+            for c in pattern:
+                if c not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._depth.append(self._depth[state] + 1)
+                    self._output.append(None)
+                    self._goto[state][c] = len(self._goto) - 1
+                state = self._goto[state][c]
+            self._output[state] = pattern
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, child in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(c, 0)
+                if self._output[child] is None:
+                    self._output[child] = self._output[self._fail[child]]
+                queue.append(child)
+
+    def step(self, state: int, c: str) -> int:
+        """1文字進めた状態を返す"""
+        while state and c not in self._goto[state]:
+            state = self._fail[state]
+        return self._goto[state].get(c, 0)
+
+    def depth(self, state: int) -> int:
+        """状態が表す、いずれかの語句の途中までに一致している末尾の文字数"""
+        return self._depth[state]
+
+    def output(self, state: int) -> str | None:
+        """状態で一致が確定した語句"""
+        return self._output[state]
+
+    def search(self, text: str) -> str | None:
+        """テキスト中で最初に一致した語句を返す"""
+        state = 0
+        for c in text:
+            state = self.step(state, c)
+            if self._output[state] is not None:
+                return self._output[state]
+        return None
+
+
+class StreamGuard:
+    """ストリームのチャンクを照合し、禁止表現を含まないと確定した部分だけを通す
+
+    語句の途中までに一致している末尾だけを保留するため、保留は最長の語句の長さ未満に収まる。
+    チャンクをまたぐ語句も検出できる。一致した場合は語句の直前までを返し、以降は何も通さない。
+    """
+
+    def __init__(self, matcher: PhraseMatcher):
+        self.matcher = matcher
+        self.reset()
+
+    def reset(self):
+        """照合状態と保留中のテキストを破棄する"""
+        self.match: str | None = None
+        self._state = 0
+        self._held = ""
+
+    def feed(self, chunk: str) -> str:
+        """チャンクを照合し、通してよいテキストを返す"""
+        if self.match is not None:
+            return ""
+        released = []
+        for c in chunk:
+            self._held += c
+            self._state = self.matcher.step(self._state, c)
+            pattern = self.matcher.output(self._state)
+            if pattern is not None:
+                self.match = pattern
+                released.append(self._held[:-len(pattern)])
+                self._held = ""
+                break
+            keep = self.matcher.depth(self._state)
+            if len(self._held) > keep:
+                cut = len(self._held) - keep
+                released.append(self._held[:cut])
+                self._held = self._held[cut:]
+        return "".join(released)
+
+    def flush(self) -> str:
+        """ストリーム終了時に保留中のテキストを返す"""
+        if self.match is not None:
+            return ""
+        held, self._held = self._held, ""
+        return held
@@ -1,5 +1,7 @@
 """全プロンプトテンプレート"""
 
+from phrase_guard import PhraseMatcher
+
 SYSTEM_PROMPT = """あなたは臨床倫理の思考整理を支援するファシリテーターです。
 Jonsenの臨床倫理4分割表に基づいて、医療チームの倫理的思考を整理する手助けをします。
 
@@ -24,23 +26,21 @@ Jonsenの臨床倫理4分割表に基づいて、医療チームの倫理的思
 「この場合、緩和ケアに移行することが患者のQOLを考えると望ましいでしょう。」"""
 
 
-QUADRANT_START_PROMPT = """現在、Jonsenの4分割表の「{quadrant_title}」について整理を始めます。
+CASE_OVERVIEW_CONTEXT = """【検討中のケース概要】
+{case_overview}"""
+
 
-ケース概要:
-{case_overview}
+QUADRANT_START_PROMPT = """現在、Jonsenの4分割表の「{quadrant_title}」について整理を始めます。
 
 この象限のサブトピック: {subtopics}
 
-上記のケース概要を踏まえ、「{quadrant_title}」に関して
+ケース概要を踏まえ、「{quadrant_title}」に関して
 2〜3個の深掘り質問を投げかけてください。
 判断や推奨は一切行わないでください。"""
 
 
 QUADRANT_FOLLOWUP_PROMPT = """現在、Jonsenの4分割表の「{quadrant_title}」について整理しています。
 
-ケース概要:
-{case_overview}
-
 まだ十分に整理されていないサブトピック: {remaining_subtopics}
 
 これまでの回答内容を踏まえ、まだ整理が足りていない点について
@@ -49,25 +49,34 @@ QUADRANT_FOLLOWUP_PROMPT = """現在、Jonsenの4分割表の「{quadrant_title}
 判断や推奨は一切行わないでください。"""
 
 
-QUADRANT_COMPLETION_CHECK_PROMPT = """以下の対話内容を確認し、「{quadrant_title}」の4つのサブトピック
-（{subtopics_list}）について十分な情報が集まったかどうかをJSON形式で判定してください。
+COMPACTED_HISTORY_PROMPT = """【これまでの対話の整理（古いやり取りは要約しています）】
+要約: {summary}
+整理済みのサブトピック: {covered_subtopics}
+未整理のサブトピックについて得られている情報:
+{partial_notes}"""
+
 
-対話内容:
-{conversation_history}
+QUADRANT_COMPLETION_CHECK_PROMPT = """「{quadrant_title}」の4つのサブトピック（{subtopics_list}）について、
+これまでの整理状況に新しい対話内容を反映し、十分な情報が集まったかどうかをJSON形式で判定してください。
+
+これまでの整理状況:
+{previous_state}
+
+新しい対話内容:
+{new_exchange}
 
 以下のJSON形式のみで回答してください（他のテキストは不要です）:
 {{
   "is_complete": true または false,
   "covered_subtopics": ["整理済みのサブトピック"],
   "remaining_subtopics": ["未整理のサブトピック"],
-  "summary": "この象限で整理された内容の要約（3〜5文）"
+  "partial_notes": {{"未整理のサブトピック": "部分的に得られている情報のメモ"}},
+  "summary": "これまでの整理状況と新しい対話内容を合わせた、この象限の要約（3〜5文）"
 }}"""
 
 
 SYNTHESIS_PROMPT = """以下の4象限の整理結果をもとに、Jonsenの臨床倫理4分割表を構造化して整理してください。
 
-ケース概要: {case_overview}
-
 【医学的適応の整理】
 {medical_indications_summary}
 
@@ -123,15 +132,59 @@ SYNTHESIS_PROMPT = """以下の4象限の整理結果をもとに、Jonsenの臨
 - 情報が得られなかった項目は「（未確認）」と記載してください"""
 
 
+
+QUADRANT_SYNTHESIS_PROMPT = """以下の「{quadrant_title}」の整理結果をもとに、Jonsenの臨床倫理4分割表のこの象限を構造化して整理してください。
+
+【{quadrant_title}の整理】
+{summary}
+
+以下のJSON形式のみで出力してください（他のテキストは不要です）:
+{template}
+
+【注意】
+- 判断や推奨は含めないでください
+- 各サブトピックの内容は対話で得られた事実のみを記載してください
+- 情報が得られなかった項目は「（未確認）」と記載してください"""
+
+
+CROSS_QUADRANT_PROMPT = """以下はJonsenの臨床倫理4分割表の各象限を構造化した結果です。
+
+{table}
+
+4つの象限を見比べ、以下のJSON形式のみで出力してください（他のテキストは不要です）:
+{{
+  "discussion_points": [
+    "検討すべきポイント（問いの形で記述）"
+  ],
+  "tensions": [
+    "象限間の対立・緊張関係の記述"
+  ]
+}}
+
+【注意】
+- 判断や推奨は含めないでください
+- 「検討すべきポイント」は問いの形で記述してください
+- 表に記載された事実のみをもとにしてください"""
+
+JSON_MISSING_FIELDS_PROMPT = """直前のJSONには以下のフィールドが欠けているか、形式が正しくありません:
+{fields}
+
+これらのフィールドだけを、元の形式と同じ入れ子構造のJSONで出力してください（他のテキストは不要です）。"""
+
+
 FORBIDDEN_PATTERNS = [
     "すべき", "べきです", "望ましい", "推奨", "お勧め",
     "最善", "最適", "適切です", "不適切です",
 ]
 
 
+FORBIDDEN_MATCHER = PhraseMatcher(FORBIDDEN_PATTERNS)
+
+
+FORBIDDEN_PHRASE_REMINDER = """【注意】直前の応答に判断を含む表現「{phrase}」が含まれていました。
+判断や推奨を含む表現を使わず、問いかけの形で続けてください。"""
+
+
 def validate_response(text: str) -> bool:
     """AIの応答に判断を含む表現がないかチェック"""
-    for pattern in FORBIDDEN_PATTERNS:
-        if pattern in text:
-            return False
-    return True
+    return FORBIDDEN_MATCHER.search(text) is None
@@ -0,0 +1,100 @@
+"""temperature=0 の呼び出し結果をローカルの SQLite に保存する応答キャッシュ"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config import (
+    RESPONSE_CACHE_PATH,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_TTL_SECONDS,
+)
+
+
+def response_cache_key(model: str, template: str, **request) -> str:
+    """モデル・プロンプトテンプレート・組み立て済みのリクエストから安定したキーを作る"""
+    payload = json.dumps(
+        {"model": model, "template": template, "request": request},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """応答テキストのディスクキャッシュ（期限切れと合計サイズ超過は最終参照の古い順に削除）"""
+
+    def __init__(
+        self,
+        path: str = RESPONSE_CACHE_PATH,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        """期限内の応答があれば返す"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM responses WHERE key = ? AND created >= ?",
+                (key, now - self.ttl_seconds),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key: str, value: str):
+        """応答を保存し、期限切れと上限超過分を削除する"""
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evict = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if total <= self.max_bytes:
+                break
+            evict.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evict)
+
+
+_response_cache: ResponseCache | None = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """プロセス共有の応答キャッシュを取得"""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+        return _response_cache
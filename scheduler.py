@@ -0,0 +1,219 @@
+"""プロセス共有の API 呼び出しスケジューラ（流量制限・優先度・再試行）"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from datetime import datetime
+
+import anthropic
+
+from config import (
+    SCHEDULER_REQUESTS_PER_MINUTE,
+    SCHEDULER_INPUT_TOKENS_PER_MINUTE,
+    SCHEDULER_OUTPUT_TOKENS_PER_MINUTE,
+    SCHEDULER_MAX_RETRIES,
+    SCHEDULER_BACKOFF_BASE,
+    SCHEDULER_BACKOFF_MAX,
+    SCHEDULER_PRIORITIES,
+)
+from telemetry import RETRIES
+
+logger = logging.getLogger(__name__)
+
+# 待ち行列の先頭でないときに状態を見直す間隔（秒）
+_POLL_INTERVAL = 0.05
+
+
+class TokenBucket:
+    """1分あたりの上限で補充されるトークンバケット（残量は負になりうる）"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self._updated = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / 60
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """amount を取り出せるまでの秒数"""
+        self._refill(now)
+        need = min(amount, self.capacity)
+        return 0.0 if self.level >= need else (need - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= amount
+
+    def sync(self, limit: float | None, remaining: float | None, now: float):
+        """応答ヘッダの上限・残量に合わせる"""
+        self._refill(now)
+        if limit:
+            self.capacity = limit
+        if remaining is not None:
+            self.level = min(self.level, remaining)
+
+
+def _header_float(headers, name: str) -> float | None:
+    value = headers.get(name)
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _seconds_until(reset: str | None) -> float | None:
+    """RFC 3339 形式のリセット時刻までの秒数"""
+    if not reset:
+        return None
+    try:
+        return datetime.fromisoformat(reset.replace("Z", "+00:00")).timestamp() - time.time()
+    except ValueError:
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """レート制限・過負荷・サーバーエラー・接続エラーは再試行する"""
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, anthropic.APIConnectionError)
+
+
+class RequestScheduler:
+    """リクエスト数と入出力トークン数のバケットで呼び出しの開始を調整する
+
+    全セッションの呼び出しを優先度順（同じ優先度なら到着順）に1つずつ通す。
+    ロックはスレッド間で共有するため、複数のイベントループから使ってよい。
+    応答ヘッダ（anthropic-ratelimit-*）で上限と残量を補正し、429 を受けたら
+    retry-after の間は全体を止める。
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = SCHEDULER_REQUESTS_PER_MINUTE,
+        input_tokens_per_minute: float = SCHEDULER_INPUT_TOKENS_PER_MINUTE,
+        output_tokens_per_minute: float = SCHEDULER_OUTPUT_TOKENS_PER_MINUTE,
+        max_retries: int = SCHEDULER_MAX_RETRIES,
+        backoff_base: float = SCHEDULER_BACKOFF_BASE,
+        backoff_max: float = SCHEDULER_BACKOFF_MAX,
+    ):
+        self.buckets = {
+            "requests": TokenBucket(requests_per_minute),
+            "input-tokens": TokenBucket(input_tokens_per_minute),
+            "output-tokens": TokenBucket(output_tokens_per_minute),
+        }
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._paused_until = 0.0
+        self._waiting: list[tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    async def acquire(self, priority: int, input_tokens: int):
+        """自分の番が来て、バケットに余裕ができるまで待つ"""
+        ticket = (priority, next(self._seq))
+        with self._lock:
+            heapq.heappush(self._waiting, ticket)
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    if self._waiting[0] == ticket:
+                        wait = max(
+                            self._paused_until - now,
+                            self.buckets["requests"].wait_time(1, now),
+                            self.buckets["input-tokens"].wait_time(input_tokens, now),
+                            self.buckets["output-tokens"].wait_time(1, now),
+                        )
+                        if wait <= 0:
+                            self.buckets["requests"].take(1)
+                            self.buckets["input-tokens"].take(input_tokens)
+                            heapq.heappop(self._waiting)
+                            return
+                    else:
+                        wait = _POLL_INTERVAL
+                await asyncio.sleep(min(wait, 1.0))
+        except BaseException:
+            with self._lock:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+            raise
+
+    def observe_headers(self, headers):
+        """応答ヘッダのレート制限情報をバケットに反映"""
+        with self._lock:
+            now = time.monotonic()
+            for kind, bucket in self.buckets.items():
+                bucket.sync(
+                    _header_float(headers, f"anthropic-ratelimit-{kind}-limit"),
+                    _header_float(headers, f"anthropic-ratelimit-{kind}-remaining"),
+                    now,
+                )
+
+    def record_output(self, output_tokens: int):
+        """出力トークンは応答が終わってから差し引く"""
+        with self._lock:
+            self.buckets["output-tokens"].take(output_tokens)
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """待ち時間（秒）。retry-after があればそれに従い、なければ上限付き指数バックオフに揺らぎを加える"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if isinstance(error, anthropic.APIStatusError):
+            headers = error.response.headers
+            retry_after = _header_float(headers, "retry-after")
+            if retry_after is None:
+                retry_after = _seconds_until(headers.get("anthropic-ratelimit-requests-reset"))
+            if retry_after is not None and retry_after > 0:
+                delay = retry_after + random.uniform(0, self.backoff_base)
+            if error.status_code == 429:
+                # 上限は組織全体で共有されるため、全ての呼び出しを止める
+                with self._lock:
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    async def call(
+        self,
+        call_type: str,
+        input_tokens: int,
+        request: Callable[[], Awaitable],
+    ):
+        """順番と流量の上限を守って request() を実行し、再試行可能なエラーはやり直す"""
+        priority = SCHEDULER_PRIORITIES.get(call_type, 1)
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(priority, input_tokens)
+            try:
+                return await request()
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = self._backoff(attempt, e)
+                RETRIES.inc(call_type=call_type, kind=type(e).__name__)
+                logger.warning(
+                    "api_retry call=%s attempt=%d error=%s delay_s=%.1f",
+                    call_type, attempt + 1, type(e).__name__, delay,
+                )
+                await asyncio.sleep(delay)
+
+
+_scheduler: RequestScheduler | None = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    """プロセス共有のスケジューラを取得"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
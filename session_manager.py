@@ -1,18 +1,132 @@
 """Streamlitセッション状態管理"""
 
+import hashlib
+import json
+import logging
+import uuid
+from concurrent.futures import Future, TimeoutError
+
 import streamlit as st
+from cancellation import CancelToken
 from config import QUADRANTS
+from coverage import new_coverage_state
+from session_store import get_session_store
+
+logger = logging.getLogger(__name__)
+
+# セッション保存先に書き出す状態（Future などプロセス内でしか使えないものは含めない）
+PERSISTED_FIELDS = (
+    "phase",
+    "current_quadrant",
+    "case_overview",
+    "conversations",
+    "quadrant_summaries",
+    "coverage",
+    "full_table_data",
+    "computed_from",
+    "correlation_id",
+    "archive_id",
+)
+# 象限ごとに分けて保存する（1ターンで変わるのは1象限分だけになる）
+_PER_QUADRANT_FIELDS = ("conversations", "quadrant_summaries", "coverage")
+
+
+def _session_id() -> str:
+    """保存先でのセッションID（URL の sid に載せ、再接続や別プロセスでも同じ状態を読む）"""
+    session_id = st.query_params.get("sid")
+    if not session_id:
+        session_id = uuid.uuid4().hex
+        st.query_params["sid"] = session_id
+    return session_id
+
+
+def _serialized_fields() -> dict[str, str]:
+    """保存する状態を、保存先のキー → コンパクトなJSON にする"""
+    fields = {}
+    for name in PERSISTED_FIELDS:
+        value = st.session_state[name]
+        items = value.items() if name in _PER_QUADRANT_FIELDS else [(None, value)]
+        for key, item in items:
+            fields[f"{name}.{key}" if key else name] = json.dumps(
+                item, ensure_ascii=False, separators=(",", ":")
+            )
+    return fields
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def _load_stored(stored: dict[str, str]) -> bool:
+    """保存先の状態をセッションに読み込む。欠けている・壊れている場合は False"""
+    try:
+        values = {}
+        for name in PERSISTED_FIELDS:
+            if name in _PER_QUADRANT_FIELDS:
+                values[name] = {
+                    q["key"]: json.loads(stored[f"{name}.{q['key']}"]) for q in QUADRANTS
+                }
+            else:
+                values[name] = json.loads(stored[name])
+    except (KeyError, json.JSONDecodeError) as e:
+        logger.warning("session_restore_failed session=%s error=%r", st.session_state.session_id, e)
+        return False
+    for name, value in values.items():
+        st.session_state[name] = value
+    st.session_state.persisted = {key: _digest(text) for key, text in stored.items()}
+    return True
+
+
+def persist_session():
+    """前回の保存から変わった状態だけを保存先に書き込む（保存先がなければ何もしない）"""
+    store = get_session_store()
+    if store is None or "phase" not in st.session_state:
+        return
+    persisted = st.session_state.persisted
+    changes = {}
+    for key, text in _serialized_fields().items():
+        digest = _digest(text)
+        if persisted.get(key) != digest:
+            changes[key] = text
+            persisted[key] = digest
+    store.save(st.session_state.session_id, changes)
 
 
 def init_session():
-    """セッション状態を初期化"""
+    """セッション状態を初期化（保存先に同じセッションの状態があれば読み込む）"""
+    if "cancel_token" not in st.session_state:
+        # セッション全体の呼び出し（先行生成を含む）と、いま表示している画面の呼び出しの取消用。
+        # プロセス内でしか使えないため保存先には書き出さない
+        st.session_state.cancel_token = CancelToken()
+        st.session_state.view_token = st.session_state.cancel_token.child()
     if "phase" not in st.session_state:
+        store = get_session_store()
+        if store is not None:
+            st.session_state.session_id = _session_id()
+            st.session_state.persisted = {}
+            stored = store.load(st.session_state.session_id)
+            if stored and _load_stored(stored):
+                # 先行生成はプロセス内の Future なので引き継がない（その場で生成し直す）
+                st.session_state.opening_questions = {}
+                return
+
         st.session_state.phase = "input"
         st.session_state.current_quadrant = 0
         st.session_state.case_overview = ""
         st.session_state.conversations = {q["key"]: [] for q in QUADRANTS}
         st.session_state.quadrant_summaries = {q["key"]: None for q in QUADRANTS}
+        st.session_state.coverage = {
+            q["key"]: new_coverage_state(q["key"]) for q in QUADRANTS
+        }
         st.session_state.full_table_data = None
+        # 象限キー → (生成元のケース概要, 最初の質問を生成中の Future)
+        st.session_state.opening_questions = {}
+        # 依存グラフのノード → 計算したときの入力のハッシュ（is_stale() を参照）
+        st.session_state.computed_from = {}
+        # ログとメトリクスでこのセッションの呼び出しを追うためのID
+        st.session_state.correlation_id = uuid.uuid4().hex[:12]
+        # ケースアーカイブでのこのケースのID（開き直したケースは保存時のID）
+        st.session_state.archive_id = uuid.uuid4().hex
 
 
 def get_current_quadrant() -> dict:
@@ -25,17 +139,153 @@ def add_message(quadrant_key: str, role: str, content: str):
     st.session_state.conversations[quadrant_key].append(
         {"role": role, "content": content}
     )
+    persist_session()
+
+
+def store_opening_questions(futures: dict[str, Future]):
+    """先行生成を始めた最初の質問を、現在のケース概要と組にして保存"""
+    st.session_state.opening_questions = {
+        key: (st.session_state.case_overview, future) for key, future in futures.items()
+    }
+
+
+def take_opening_question(quadrant_key: str, timeout: float | None = 0) -> str | None:
+    """先行生成した最初の質問を取り出す
+
+    timeout 秒待っても終わっていなければ None を返し、後で取り出せるよう残しておく。
+    生成に失敗した場合やケース概要が変わった場合も None（呼び出し側でその場で生成する）。
+    """
+    entry = st.session_state.get("opening_questions", {}).get(quadrant_key)
+    if entry is None:
+        return None
+    case_overview, future = entry
+    if case_overview != st.session_state.case_overview:
+        del st.session_state.opening_questions[quadrant_key]
+        future.cancel()
+        return None
+    try:
+        text = future.result(timeout=timeout)
+    except TimeoutError:
+        return None
+    except Exception as e:
+        del st.session_state.opening_questions[quadrant_key]
+        logger.warning("opening_prefetch_failed quadrant=%s error=%s", quadrant_key, type(e).__name__)
+        return None
+    del st.session_state.opening_questions[quadrant_key]
+    return text or None
+
+
+def content_hash(value) -> str:
+    """JSONにできる値の内容ハッシュ"""
+    data = json.dumps(value, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()[:16]
+
+
+def _node_inputs(node: str):
+    """依存グラフのノードが直接依存する値
+
+    ケース概要 → 象限の会話 → 象限の要約（"summary:<象限キー>"）
+    → 象限の表（"table:<象限キー>"）→ 表全体（"table_data"）→ PDF の順に依存する。
+    PDF は PDFCache が表データの内容ハッシュで管理する。
+    """
+    state = st.session_state
+    kind, _, key = node.partition(":")
+    if kind == "summary":
+        return [state.case_overview, state.conversations[key]]
+    if kind == "table":
+        return [state.case_overview, state.quadrant_summaries[key]]
+    if kind == "table_data":
+        return [state.case_overview, state.quadrant_summaries]
+    raise ValueError(f"unknown node: {node}")
+
+
+def mark_computed(node: str):
+    """ノードを現在の入力から計算し直したことを記録"""
+    st.session_state.computed_from[node] = content_hash(_node_inputs(node))
+
+
+def is_stale(node: str) -> bool:
+    """ノードが未計算か、計算後に入力（会話の追記など）が変わっていれば True"""
+    return st.session_state.computed_from.get(node) != content_hash(_node_inputs(node))
+
+
+def _leave_view():
+    """表示中の画面の呼び出しを取り消し、次の画面用の取消トークンに切り替える"""
+    st.session_state.view_token.cancel("navigation")
+    st.session_state.view_token = st.session_state.cancel_token.child()
+
+
+def go_to(phase: str, quadrant: int | None = None):
+    """フェーズ（と象限）を切り替える。前の画面で実行中の呼び出しは取り消す"""
+    _leave_view()
+    st.session_state.phase = phase
+    if quadrant is not None:
+        st.session_state.current_quadrant = quadrant
+    persist_session()
 
 
 def advance_quadrant():
-    """次の象限へ進む。全象限完了ならまとめフェーズへ"""
-    if st.session_state.current_quadrant < len(QUADRANTS) - 1:
-        st.session_state.current_quadrant += 1
-    else:
-        st.session_state.phase = "summary"
+    """要約が古い（未完了・修正済み）次の象限へ進む。なければまとめフェーズへ
+
+    次の象限の最初の質問が先行生成済みなら、そのまま会話に加えておく。
+    """
+    _leave_view()
+    for index in range(st.session_state.current_quadrant + 1, len(QUADRANTS)):
+        key = QUADRANTS[index]["key"]
+        if is_stale(f"summary:{key}"):
+            st.session_state.current_quadrant = index
+            if not st.session_state.conversations[key]:
+                if text := take_opening_question(key):
+                    add_message(key, "assistant", text)
+            persist_session()
+            return
+    st.session_state.phase = "summary"
+    persist_session()
 
 
 def reset_session():
-    """セッションをリセット"""
+    """セッションをリセット（実行中の呼び出しは取り消し、保存先の状態も削除する）"""
+    if "cancel_token" in st.session_state:
+        st.session_state.cancel_token.cancel("reset")
+    store = get_session_store()
+    if store is not None and "session_id" in st.session_state:
+        store.delete(st.session_state.session_id)
     for key in list(st.session_state.keys()):
         del st.session_state[key]
+
+
+def archive_record() -> dict:
+    """ケースアーカイブに保存するセッションの内容"""
+    state = st.session_state
+    return {
+        "case_overview": state.case_overview,
+        "conversations": state.conversations,
+        "quadrant_summaries": state.quadrant_summaries,
+        "coverage": state.coverage,
+        "full_table_data": state.full_table_data,
+    }
+
+
+def restore_session(case_id: str, record: dict, phase: str = "summary"):
+    """アーカイブのケースをまとめ（またはレポート）フェーズで開き直す
+
+    保存時の要約と表をそのまま計算済みとして扱うため、API は呼ばない。
+    """
+    reset_session()
+    init_session()
+    state = st.session_state
+    state.archive_id = case_id
+    state.case_overview = record["case_overview"]
+    for quad in QUADRANTS:
+        key = quad["key"]
+        state.conversations[key] = record["conversations"].get(key, [])
+        state.quadrant_summaries[key] = record["quadrant_summaries"].get(key)
+        state.coverage[key] = record.get("coverage", {}).get(key) or new_coverage_state(key)
+        if state.quadrant_summaries[key] is not None:
+            mark_computed(f"summary:{key}")
+        mark_computed(f"table:{key}")
+    state.full_table_data = record["full_table_data"]
+    mark_computed("table_data")
+    state.current_quadrant = len(QUADRANTS) - 1
+    state.phase = phase
+    persist_session()
@@ -0,0 +1,104 @@
+"""セッション状態の外部保存先（複数プロセス・再起動をまたいで対話を続けるため）"""
+
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from config import SESSION_STORE_BACKEND, SESSION_STORE_PATH, SESSION_STORE_TTL_SECONDS
+
+
+class SessionStore(ABC):
+    """セッションIDごとに「キー → シリアライズ済みの値」を保存する保存先の共通インターフェース
+
+    値の変化したキーだけを save() に渡すため、1ターンの書き込みは差分で済む。
+    """
+
+    @abstractmethod
+    def load(self, session_id: str) -> dict[str, str]:
+        """保存済みの全キー（なければ空の辞書。期限切れのセッションも空）"""
+
+    @abstractmethod
+    def save(self, session_id: str, changes: dict[str, str]):
+        """変化したキーだけを書き込む"""
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """セッションの全キーを削除する"""
+
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite のファイルに保存する（同じファイルを共有するプロセス間で使える）
+
+    最後の保存から ttl_seconds を過ぎたセッションは読み込まず、保存のたびに削除する。
+    """
+
+    def __init__(self, path: str = SESSION_STORE_PATH, ttl_seconds: float = SESSION_STORE_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_state ("
+            " session_id TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " updated REAL NOT NULL, PRIMARY KEY (session_id, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS session_state_updated ON session_state (updated)")
+        self._lock = threading.Lock()
+        self.expire()
+
+    def load(self, session_id: str) -> dict[str, str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM session_state WHERE session_id = ? AND updated >= ?",
+                (session_id, time.time() - self.ttl_seconds),
+            ).fetchall()
+        return dict(rows)
+
+    def save(self, session_id: str, changes: dict[str, str]):
+        if not changes:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO session_state (session_id, key, value, updated)"
+                " VALUES (?, ?, ?, ?)",
+                [(session_id, key, value, now) for key, value in changes.items()],
+            )
+            # 残りのキーも更新日時を揃え、使われているセッションが期限切れにならないようにする
+            self._conn.execute(
+                "UPDATE session_state SET updated = ? WHERE session_id = ?", (now, session_id)
+            )
+        self.expire()
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM session_state WHERE session_id = ?", (session_id,))
+
+    def expire(self):
+        """期限切れのセッションを削除"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM session_state WHERE updated < ?", (time.time() - self.ttl_seconds,)
+            )
+
+
+_session_store: SessionStore | None = None
+_session_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore | None:
+    """プロセス共有のセッション保存先（SESSION_STORE_BACKEND が None なら使わない）"""
+    global _session_store
+    if SESSION_STORE_BACKEND is None:
+        return None
+    with _session_store_lock:
+        if _session_store is None:
+            if SESSION_STORE_BACKEND != "sqlite":
+                raise ValueError(f"unknown session store backend: {SESSION_STORE_BACKEND}")
+            _session_store = SQLiteSessionStore()
+        return _session_store
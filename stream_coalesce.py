@@ -0,0 +1,56 @@
+"""ストリーミング出力の細かいチャンクをまとめて、画面の更新回数を減らす"""
+
+import time
+
+from config import STREAM_COALESCE_MS, STREAM_COALESCE_MAX_CHARS
+
+# ここまで届いたら待たずに送る文の区切り
+SENTENCE_BOUNDARIES = "。！？\n"
+
+
+class ChunkCoalescer:
+    """チャンクを時間と長さでまとめ、文の区切りでは必ず送り出す
+
+    最初のチャンクは最初の表示を遅らせないようにすぐ送る。以降は、バッファに文の区切りが
+    入ればそこまでを、window_ms 経過するか max_chars に達すれば全体を送る。
+    受け取ったチャンク数（received）と送り出した数（emitted）を数える。
+    """
+
+    def __init__(
+        self,
+        window_ms: float = STREAM_COALESCE_MS,
+        max_chars: int = STREAM_COALESCE_MAX_CHARS,
+        clock=time.monotonic,
+    ):
+        self.window = window_ms / 1000
+        self.max_chars = max_chars
+        self.clock = clock
+        self.received = 0
+        self.emitted = 0
+        self._buffer = ""
+        self._last_flush: float | None = None
+
+    def _release(self, text: str) -> str:
+        self._last_flush = self.clock()
+        if text:
+            self.emitted += 1
+        return text
+
+    def feed(self, chunk: str) -> str:
+        """チャンクを受け取り、今送るべきテキスト（なければ空文字列）を返す"""
+        self.received += 1
+        self._buffer += chunk
+        if self._last_flush is None:
+            return self.flush()
+        if len(self._buffer) >= self.max_chars or self.clock() - self._last_flush >= self.window:
+            return self.flush()
+        cut = max(self._buffer.rfind(c) for c in SENTENCE_BOUNDARIES) + 1
+        if cut:
+            text, self._buffer = self._buffer[:cut], self._buffer[cut:]
+            return self._release(text)
+        return ""
+
+    def flush(self) -> str:
+        """バッファに残っているテキストをすべて返す"""
+        text, self._buffer = self._buffer, ""
+        return self._release(text)
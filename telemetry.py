@@ -0,0 +1,264 @@
+"""呼び出しごとの計測と Prometheus 形式のメトリクス出力"""
+
+import asyncio
+import bisect
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# セッション（対話）やバッチのケースを横断して呼び出しを追うためのID
+_correlation_id: contextvars.ContextVar[str] = contextvars.ContextVar("correlation_id", default="-")
+
+
+def set_correlation_id(correlation_id: str):
+    """現在のコンテキスト（スレッド・タスク）の相関IDを設定"""
+    _correlation_id.set(correlation_id)
+
+
+def get_correlation_id() -> str:
+    return _correlation_id.get()
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    """ラベルごとの単調増加カウンタ"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return lines
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {_format_labels(key) or "total": value for key, value in self._values.items()}
+
+
+class Histogram:
+    """ラベルごとのヒストグラム。p50/p95 用に直近の観測値も保持する"""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple[float, ...], recent: int = 1024):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.recent = recent
+        # ラベル → [バケットごとの件数, 合計, 件数, 直近の観測値]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [[0] * len(self.buckets), 0.0, 0, deque(maxlen=self.recent)]
+                self._series[key] = series
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+            series[3].append(value)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count, _) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f"{self.name}_bucket{_format_labels(key, (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', '+Inf'),))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total:g}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+    def snapshot(self) -> dict:
+        """ラベルごとの件数と直近の観測値の p50/p95"""
+        with self._lock:
+            result = {}
+            for key, (_, total, count, recent) in self._series.items():
+                ordered = sorted(recent)
+                result[_format_labels(key) or "total"] = {
+                    "count": count,
+                    "mean": total / count,
+                    "p50": ordered[int(len(ordered) * 0.5)],
+                    "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                }
+            return result
+
+
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+CALL_DURATION = Histogram(
+    "ethicsnavi_call_duration_seconds", "Wall time per call", _LATENCY_BUCKETS
+)
+CALL_TTFT = Histogram(
+    "ethicsnavi_call_ttft_seconds", "Time to first streamed token or entry", _LATENCY_BUCKETS
+)
+CALLS = Counter("ethicsnavi_calls_total", "Calls by outcome")
+TOKENS = Counter("ethicsnavi_tokens_total", "API tokens by kind")
+RETRIES = Counter("ethicsnavi_retries_total", "Extra API requests made to recover a call")
+PARSE_FAILURES = Counter("ethicsnavi_parse_failures_total", "Responses that could not be parsed")
+FALLBACKS = Counter("ethicsnavi_fallbacks_total", "Fallback branches taken")
+STREAM_CHUNKS = Counter(
+    "ethicsnavi_stream_chunks_total", "Streamed text chunks received from the API and emitted to the UI"
+)
+CANCELLATIONS = Counter(
+    "ethicsnavi_cancellations_total", "In-flight calls aborted because the user navigated away"
+)
+PDF_CACHE = Counter("ethicsnavi_pdf_cache_total", "PDF cache lookups and discarded builds by result")
+
+METRICS = (
+    CALL_DURATION, CALL_TTFT, CALLS, TOKENS, RETRIES, PARSE_FAILURES, FALLBACKS,
+    STREAM_CHUNKS, CANCELLATIONS, PDF_CACHE,
+)
+
+
+class CallSpan:
+    """1回の呼び出しの計測（call_span() が作る）"""
+
+    def __init__(self, call_type: str):
+        self.call_type = call_type
+        self.correlation_id = get_correlation_id()
+        self.started = time.perf_counter()
+        self.ttft: float | None = None
+        self.routes: list[str] = []
+        self.models: list[str] = []
+
+    def set_route(self, route: str, model: str):
+        """この呼び出しに使ったルートとモデルを記録（複数使った場合は "+" でつなぐ）"""
+        if route not in self.routes:
+            self.routes.append(route)
+        if model not in self.models:
+            self.models.append(model)
+
+    @property
+    def labels(self) -> dict:
+        return {
+            "call_type": self.call_type,
+            "route": "+".join(self.routes) or "-",
+            "model": "+".join(self.models) or "-",
+        }
+
+    def first_token(self):
+        """最初のトークン（またはイベント）を受け取った時点を記録"""
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.started
+            CALL_TTFT.observe(self.ttft, **self.labels)
+
+    def retry(self, kind: str):
+        RETRIES.inc(call_type=self.call_type, kind=kind)
+
+    def fallback(self, branch: str):
+        FALLBACKS.inc(call_type=self.call_type, branch=branch)
+
+
+@contextmanager
+def call_span(call_type: str):
+    """呼び出し全体の所要時間と結果を記録し、相関ID付きでログに残す"""
+    span = CallSpan(call_type)
+    outcome = "ok"
+    try:
+        yield span
+    except (GeneratorExit, asyncio.CancelledError):
+        outcome = "cancelled"
+        raise
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - span.started
+        labels = span.labels
+        CALL_DURATION.observe(elapsed, **labels)
+        CALLS.inc(outcome=outcome, **labels)
+        logger.info(
+            "call type=%s route=%s model=%s correlation_id=%s outcome=%s wall_ms=%.0f ttft_ms=%s",
+            call_type, labels["route"], labels["model"], span.correlation_id, outcome, elapsed * 1000,
+            f"{span.ttft * 1000:.0f}" if span.ttft is not None else "-",
+        )
+
+
+def record_tokens(call_type: str, usage: dict):
+    """_usage_dict() 形式の使用量をカウンタに加算"""
+    for kind, value in usage.items():
+        if value:
+            TOKENS.inc(value, call_type=call_type, kind=kind.removesuffix("_tokens"))
+
+
+def render_metrics() -> str:
+    """Prometheus のテキスト形式"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def metrics_snapshot() -> dict:
+    """呼び出し種別ごとの p50/p95 などをまとめた辞書"""
+    return {metric.name: metric.snapshot() for metric in METRICS}
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = render_metrics().encode()
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body = json.dumps(metrics_snapshot(), ensure_ascii=False).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer | None:
+    """/metrics と /metrics.json を返すサーバーを別スレッドで起動する
+
+    同じポートを別プロセスが使っている場合は起動せず None を返す。
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.warning("metrics server not started port=%d error=%s", port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="ethicsnavi-metrics", daemon=True).start()
+    return server
@@ -0,0 +1,40 @@
+"""API を呼ばずにトークン数を見積もる（予算管理・流量制御用）"""
+
+import json
+
+# 日本語などの非ASCII文字は1文字1トークン、ASCIIは4文字1トークンとして多めに見積もる
+ASCII_CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """テキストのおおよそのトークン数"""
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return (len(text) - ascii_chars) + -(-ascii_chars // ASCII_CHARS_PER_TOKEN)
+
+
+def _content_text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content)
+
+
+def estimate_request_tokens(system, messages: list[dict]) -> int:
+    """system とメッセージ列からなるリクエストの入力トークン数（メッセージごとの区切り分を含む）"""
+    if isinstance(system, list):
+        system = _content_text(system)
+    elif not isinstance(system, str):
+        system = json.dumps(system, ensure_ascii=False)
+    return estimate_tokens(system or "") + sum(
+        estimate_tokens(_content_text(m["content"])) + 4 for m in messages
+    )
+
+
+def truncate_to_tokens(text: str, max_tokens: int, marker: str = "…（中略）…") -> str:
+    """見積もりが max_tokens を超えるテキストの中ほどを省略する（冒頭と末尾は残す）"""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    keep = max(0, int(len(text) * max_tokens / tokens) - len(marker))
+    head = keep // 2
+    tail = keep - head
+    return text[:head] + marker + (text[-tail:] if tail else "")